@@ -0,0 +1,132 @@
+"""
+Admission control for the chat endpoints.
+
+Every request first passes per-session and per-IP token buckets, then waits for one of
+MAX_CONCURRENT_QUERIES slots. At most ADMISSION_MAX_WAITING requests may wait, each for up to
+ADMISSION_WAIT_TIMEOUT seconds. A request that is refused raises Shed right away instead of
+piling onto Gemini and Neon. The caller answers it with degraded_reply(), which costs no LLM
+call or query. stats counts shed requests by reason.
+"""
+import time
+import asyncio
+import logging
+from collections import Counter, OrderedDict
+from contextlib import asynccontextmanager
+from config import (
+    MAX_CONCURRENT_QUERIES, ADMISSION_MAX_WAITING, ADMISSION_WAIT_TIMEOUT,
+    SESSION_RATE_LIMIT, SESSION_BURST, IP_RATE_LIMIT, IP_BURST, RATE_LIMIT_MAX_KEYS
+)
+from router import TEMPLATE_REPLIES, classify_template
+
+BUSY_REPLY = "We're receiving a lot of messages right now, please try again in a minute. "
+
+SHED_REASONS = ("session_rate", "ip_rate", "queue_full", "wait_timeout")
+stats = Counter()  # shed requests by reason
+
+class Shed(Exception):
+    """The request was refused; reason is one of SHED_REASONS"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def seconds_until_token(self):
+        return max(0.0, (1 - self.tokens) / self.rate) if self.rate else 60.0
+
+class RateLimiter:
+    """Token bucket per key, keeping the most recently used RATE_LIMIT_MAX_KEYS keys"""
+
+    def __init__(self, rate, capacity, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+
+    def bucket(self, key):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.capacity)
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+        bucket.refill()
+        return bucket
+
+session_limiter = RateLimiter(SESSION_RATE_LIMIT, SESSION_BURST)
+ip_limiter = RateLimiter(IP_RATE_LIMIT, IP_BURST)
+slots = asyncio.Semaphore(MAX_CONCURRENT_QUERIES)
+waiting = 0  # requests queued for a slot
+active = 0  # requests holding a slot
+
+def _shed(reason, retry_after):
+    stats[reason] += 1
+    logging.warning("Shedding request: %s", reason)
+    raise Shed(reason, retry_after)
+
+def check_rate_limits(session_id, client_ip):
+    """Take a token from the session's and the client's bucket, or raise Shed"""
+    buckets = [("session_rate", session_limiter.bucket(session_id))]
+    if client_ip:
+        buckets.append(("ip_rate", ip_limiter.bucket(client_ip)))
+    for reason, bucket in buckets:
+        if bucket.tokens < 1:
+            _shed(reason, bucket.seconds_until_token())
+    for _, bucket in buckets:
+        bucket.tokens -= 1
+
+@asynccontextmanager
+async def slot():
+    """
+    Hold one of the MAX_CONCURRENT_QUERIES slots for the duration of the block
+
+    Raises:
+        Shed: The wait queue is full, or no slot freed up within ADMISSION_WAIT_TIMEOUT
+    """
+    global waiting, active
+    if slots.locked():
+        if waiting >= ADMISSION_MAX_WAITING:
+            _shed("queue_full", ADMISSION_WAIT_TIMEOUT)
+        waiting += 1
+        try:
+            await asyncio.wait_for(slots.acquire(), timeout=ADMISSION_WAIT_TIMEOUT)
+        except asyncio.TimeoutError:
+            _shed("wait_timeout", ADMISSION_WAIT_TIMEOUT)
+        finally:
+            waiting -= 1
+    else:
+        await slots.acquire()
+    active += 1
+    try:
+        yield
+    finally:
+        active -= 1
+        slots.release()
+
+@asynccontextmanager
+async def admit(session_id, client_ip=None):
+    """Rate-limit the request, then hold a query slot for the duration of the block"""
+    check_rate_limits(session_id, client_ip)
+    async with slot():
+        yield
+
+def degraded_reply(user_query):
+    """Canned reply for a shed request: the template answer if there is one, else a busy notice"""
+    templates = classify_template(user_query)
+    if templates:
+        return " ".join(TEMPLATE_REPLIES[template] for template in templates)
+    return BUSY_REPLY + TEMPLATE_REPLIES["OurContactDetails"]
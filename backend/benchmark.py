@@ -0,0 +1,454 @@
+"""
+Offline benchmarks for the chat backend.
+
+Usage:
+    DB_LOCAL_MODE=1 python benchmark.py pool [--requests 200] [--concurrency 10]
+    python benchmark.py llm [--requests 50] [--concurrency 50] [--latency 1.0]
+    python benchmark.py retrieval [--sizes 1 10 100 1000] [--queries 200]
+    python benchmark.py prompt [--iterations 10000]
+    python benchmark.py roundtrips [--turns 5] [--max 2] [--local-db]
+    python benchmark.py memory [--turns 1 10 50 200] [--iterations 200]
+    python benchmark.py routing [--latency 1.0]
+    python benchmark.py load [--concurrency 1 10 50] [--sessions 100] [--turns 5] [--latency 0.5]
+                             [--error-rate 0.02] [--db-latency 0.005] [--transcripts FILE] [--no-cache] [--local-db]
+                             [--max-p99-ms N] [--max-round-trips N]
+"""
+import argparse
+import asyncio
+import logging
+import random
+import re
+import sys
+import time
+from contextlib import asynccontextmanager
+
+import database
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def _report(label, samples, elapsed):
+    print(
+        f"{label:<10} n={len(samples):<5} "
+        f"p50={_percentile(samples, 50) * 1000:7.2f}ms "
+        f"p95={_percentile(samples, 95) * 1000:7.2f}ms "
+        f"p99={_percentile(samples, 99) * 1000:7.2f}ms "
+        f"rps={len(samples) / elapsed:8.1f}"
+    )
+
+async def _run_concurrently(task, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    samples = []
+
+    async def timed():
+        async with semaphore:
+            start = time.perf_counter()
+            await task()
+            samples.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(timed() for _ in range(requests)))
+    return samples, time.perf_counter() - start
+
+# Pooled vs unpooled round-trips
+async def bench_pool(args):
+    async def unpooled():
+        conn = await database.connect_to_neon()
+        try:
+            await conn.fetchval("SELECT 1")
+        finally:
+            await conn.close()
+
+    async def pooled():
+        async with database.acquire() as conn:
+            await conn.fetchval("SELECT 1")
+
+    await database.init_pool()
+    try:
+        for label, task in (("unpooled", unpooled), ("pooled", pooled)):
+            samples, elapsed = await _run_concurrently(task, args.requests, args.concurrency)
+            _report(label, samples, elapsed)
+    finally:
+        await database.close_pool()
+
+# LLM call overlap with the offline fake model
+async def bench_llm(args):
+    import llm_service
+    from fake_llm import FakeLLM
+
+    llm_service.llm = FakeLLM(latency=args.latency)
+    llm_service.response_cache = None  # measure LLM calls, not cache hits
+    bulk_content = {1: "RK Nature Cure Home is a naturopathy center in Coimbatore."}
+
+    async def query():
+        await llm_service.process_user_query("Do you have therapy for back pain?", bulk_content)
+
+    for label, concurrency in (("serial", 1), ("concurrent", args.concurrency)):
+        samples, elapsed = await _run_concurrently(query, args.requests, concurrency)
+        _report(label, samples, elapsed)
+
+# Prompt size and retrieval latency as the corpus grows
+SAMPLE_QUERIES = [
+    "What are the charges for a deluxe room?",
+    "Do you have therapy for back pain?",
+    "Who founded RK Nature Cure Home?",
+    "Can I get mud therapy for joint pain?",
+    "What is your address and phone number?",
+]
+
+def bench_retrieval(args):
+    from prompt_builder import build_prompt
+    from retrieval import RetrievalIndex, retrieve_content, estimate_tokens
+
+    base = database.fetch_keywords_data()
+    print(f"{'copies':>7} {'docs':>6} {'build ms':>9} {'p50 us':>8} {'p99 us':>8} {'full tokens':>12} {'top-k tokens':>13}")
+    for copies in args.sizes:
+        # Grow the corpus by repeating the real documents under new IDs
+        corpus = {}
+        for copy in range(copies):
+            for content_id, info in base.items():
+                corpus[copy * len(base) + content_id] = info
+
+        start = time.perf_counter()
+        index = RetrievalIndex(corpus)
+        build_time = time.perf_counter() - start
+
+        samples = []
+        for i in range(args.queries):
+            query = SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)]
+            start = time.perf_counter()
+            retrieve_content(index, query)
+            samples.append(time.perf_counter() - start)
+
+        full_content = {content_id: info["content"] for content_id, info in corpus.items()}
+        full_tokens = estimate_tokens(build_prompt(SAMPLE_QUERIES[0], full_content))
+        topk_tokens = estimate_tokens(build_prompt(SAMPLE_QUERIES[0], retrieve_content(index, SAMPLE_QUERIES[0])))
+        print(
+            f"{copies:>7} {len(corpus):>6} {build_time * 1000:>9.1f} "
+            f"{_percentile(samples, 50) * 1e6:>8.0f} {_percentile(samples, 99) * 1e6:>8.0f} "
+            f"{full_tokens:>12} {topk_tokens:>13}"
+        )
+
+# Prompt-building cost per request, with and without the cached static prefix
+def bench_prompt(args):
+    from prompt_builder import build_prompt, get_static_prefix
+    from retrieval import retrieve_content
+    from conversation_memory import ConversationMemory
+
+    bulk_content = retrieve_content(database.get_content_index(), SAMPLE_QUERIES[0])
+    for label, cold in (("cold", True), ("cached", False)):
+        samples = []
+        for i in range(args.iterations):
+            if cold:
+                get_static_prefix.cache_clear()
+            start = time.perf_counter()
+            build_prompt(SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)], bulk_content, memory=ConversationMemory("Asked about pricing.", ()), name="Asha", phone="9876543210")
+            samples.append(time.perf_counter() - start)
+        print(
+            f"{label:<7} p50={_percentile(samples, 50) * 1e6:7.1f}us "
+            f"p99={_percentile(samples, 99) * 1e6:7.1f}us "
+            f"per-request={sum(samples) / len(samples) * 1e6:7.1f}us"
+        )
+
+# Database round-trips per chat turn
+class RecordingConnection:
+    """
+    Stands in for an asyncpg connection and records every query as one round-trip
+    
+    It replaces database.acquire, so it only sees the queries the app sends: the reset
+    query asyncpg's pool runs when a connection is released is not counted (use --local-db
+    to count it).
+
+    Args:
+        latency (float): Seconds each query takes (a simulated network round-trip)
+    """
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.queries = []
+
+    async def _record(self, query):
+        self.queries.append(query)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def execute(self, query, *args):
+        await self._record(query)
+        return "INSERT 0 1"
+
+    async def fetchrow(self, query, *args):
+        await self._record(query)
+        return {"name": None, "phone": None, "summary": None, "recent_turns": None}
+
+    async def fetch(self, query, *args):
+        await self._record(query)
+        return []
+
+    async def fetchval(self, query, *args):
+        await self._record(query)
+        return None
+
+def _use_recording_connection(conn):
+    @asynccontextmanager
+    async def recording_acquire():
+        yield conn
+
+    database.acquire = recording_acquire
+
+async def _use_local_db():
+    # Without DB_LOCAL_MODE=1 the pool would point at Neon and write benchmark sessions there
+    if not database.DB_LOCAL_MODE:
+        sys.exit("--local-db needs DB_LOCAL_MODE=1 (and LOCAL_PG_DSN); refusing to benchmark against the Neon database")
+    await database.init_pool()
+
+async def bench_roundtrips(args):
+    import llm_service
+    import main as server
+    from fake_llm import FakeLLM
+
+    logging.getLogger().setLevel(logging.WARNING)
+    if args.local_db:
+        # Counts every query the pool sends, including its reset on each release
+        await _use_local_db()
+        count_round_trips = lambda: database.round_trips
+    else:
+        conn = RecordingConnection()
+        _use_recording_connection(conn)
+        count_round_trips = lambda: len(conn.queries)
+    llm_service.llm = FakeLLM(latency=0)
+
+    worst = 0
+    start = count_round_trips()
+    try:
+        for turn in range(args.turns):
+            before = count_round_trips()
+            await server.handle_query("bench-session", f"Question {turn}: what are your timings?")
+            worst = max(worst, count_round_trips() - before)
+    finally:
+        if args.local_db:
+            await database.close_pool()
+    print(f"turns={args.turns} round-trips={count_round_trips() - start} max per turn={worst} (limit {args.max})")
+    if worst > args.max:
+        sys.exit(1)
+
+# Prompt size and build time vs session length: whole transcript vs bounded memory
+def bench_memory(args):
+    from prompt_builder import build_prompt
+    from retrieval import retrieve_content, estimate_tokens
+    import conversation_memory
+
+    bulk_content = retrieve_content(database.get_content_index(), SAMPLE_QUERIES[0])
+    reply = "We offer naturopathy treatments including mud therapy, hydrotherapy and yoga. " * 3
+    print(f"{'turns':>6} {'transcript tokens':>18} {'memory tokens':>14} {'transcript us':>14} {'memory us':>10}")
+    for turn_count in args.turns:
+        turns = [(SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)], reply) for i in range(turn_count)]
+        summary = "User is asking about treatments and room charges."
+        # What used to be passed as chat_summary: the whole log plus the summary
+        log = " | ".join(f"User: {user} | Bot: {bot}" for user, bot in turns)
+        transcript_context = f"Chat history summary: {{'log': {log!r}, 'summary': {summary!r}}}\n\n"
+        state = {'summary': summary, 'turns': turns[-conversation_memory.MEMORY_RECENT_TURNS:]}
+
+        results = []
+        for build in (
+            lambda: transcript_context + build_prompt(SAMPLE_QUERIES[0], bulk_content),
+            lambda: build_prompt(SAMPLE_QUERIES[0], bulk_content, memory=conversation_memory.from_state(state)),
+        ):
+            start = time.perf_counter()
+            for _ in range(args.iterations):
+                prompt = build()
+            results.append((estimate_tokens(prompt), (time.perf_counter() - start) / args.iterations * 1e6))
+        (old_tokens, old_us), (new_tokens, new_us) = results
+        print(f"{turn_count:>6} {old_tokens:>18} {new_tokens:>14} {old_us:>14.1f} {new_us:>10.1f}")
+
+# Which tier answers a realistic mix of turns, and what that saves
+ROUTING_TURNS = [
+    "Hi", "Where are you located?", "What are your timings?", "What is your address and phone number?",
+    "Do you have therapy for back pain?", "My name is Priya", "9876543210", "What is your contact number?",
+    "Can I get mud therapy for joint pain?", "When do you open?", "What are the charges for a deluxe room?",
+    "Thank you", "How do I reach you?", "Is the centre open on Sunday?", "Bye",
+]
+
+async def bench_routing(args):
+    import llm_service
+    import router
+    from fake_llm import FakeLLM
+    from retrieval import retrieve_content
+
+    logging.getLogger().setLevel(logging.WARNING)
+    llm_service.llm = FakeLLM(latency=args.latency)
+    llm_service.response_cache = None  # count template and LLM turns, not cache hits
+    index = database.get_content_index()
+    for query in ROUTING_TURNS:
+        await llm_service.process_user_query(query, retrieve_content(index, query))
+
+    report = router.routing_report()
+    print(f"{'tier':<9} {'share':>6} {'mean ms':>9}")
+    for tier in router.TIERS:
+        print(f"{tier:<9} {report['share'][tier]:>6.0%} {report['mean_seconds'][tier] * 1000:>9.2f}")
+    print(f"templates: {report['templates']}")
+    print(f"LLM calls: {llm_service.llm.calls}/{report['turns']} turns, ~{report['prompt_tokens_avoided']} prompt tokens avoided")
+
+# Multi-turn sessions replayed against /submit_query at several concurrency levels
+def _load_sessions(args):
+    """User messages per session: from chat_logs-style transcripts, or synthetic"""
+    if args.transcripts:
+        sessions = []
+        with open(args.transcripts, encoding="utf-8") as f:
+            for line in f:
+                turns = re.findall(r"User: (.*?) \| Bot:", line)
+                if turns:
+                    sessions.append(turns)
+        return sessions
+    rng = random.Random(0)
+    pool = ROUTING_TURNS + SAMPLE_QUERIES
+    return [["Hi"] + rng.sample(pool, args.turns - 1) for _ in range(args.sessions)]
+
+async def bench_load(args):
+    import admission
+    import llm_service
+    import metrics
+    import write_behind
+    import main as server
+    from fake_llm import FakeLLM
+
+    logging.getLogger().setLevel(logging.ERROR)
+    llm_service.llm = FakeLLM(latency=args.latency, error_rate=args.error_rate)
+    # Every replayed session comes from one client; measure the pipeline, not the rate limits
+    admission.check_rate_limits = lambda session_id, client_ip: None
+    if args.no_cache:
+        llm_service.response_cache = None
+    if args.local_db:
+        await _use_local_db()
+        count_round_trips = lambda: database.round_trips
+    else:
+        conn = RecordingConnection(latency=args.db_latency)
+        _use_recording_connection(conn)
+        count_round_trips = lambda: len(conn.queries)
+
+    sessions = _load_sessions(args)
+    client = server.app.test_client()
+    print(f"{len(sessions)} sessions, {sum(map(len, sessions))} turns per run; "
+          f"LLM latency {args.latency}s, error rate {args.error_rate:.0%}")
+    print(f"{'conc':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'rps':>7} {'errors':>7} {'shed':>5} {'rt/turn':>8} {'tokens/turn':>12} {'llm calls':>10} {'cache hits':>11}")
+    cache = llm_service.response_cache
+    failed = False
+    try:
+        for concurrency in args.concurrency:
+            if cache is not None:
+                cache.entries.clear()
+            hits_before = cache.hits if cache is not None else 0
+            write_behind.start()
+            round_trips_before = count_round_trips()
+            tokens_before = metrics.llm_tokens.series["prompt"][1]
+            calls_before = llm_service.llm.calls
+            shed_before = sum(admission.stats.values())
+            semaphore = asyncio.Semaphore(concurrency)
+            samples = []
+            errors = 0
+
+            async def replay(number, turns):
+                nonlocal errors
+                async with semaphore:
+                    for turn in turns:
+                        start = time.perf_counter()
+                        response = await client.post("/submit_query", json={
+                            "SessionId": f"load-{concurrency}-{number}", "Query": turn
+                        })
+                        samples.append(time.perf_counter() - start)
+                        if response.status_code != 200:
+                            errors += 1
+
+            start = time.perf_counter()
+            await asyncio.gather(*(replay(number, turns) for number, turns in enumerate(sessions)))
+            elapsed = time.perf_counter() - start
+            # Flush queued writes so they are counted with this run
+            await write_behind.stop()
+
+            turns = len(samples)
+            round_trips = (count_round_trips() - round_trips_before) / turns
+            tokens = (metrics.llm_tokens.series["prompt"][1] - tokens_before) / turns
+            p99 = _percentile(samples, 99) * 1000
+            hits = cache.hits - hits_before if cache is not None else 0
+            print(
+                f"{concurrency:>5} {_percentile(samples, 50) * 1000:>8.1f} {_percentile(samples, 95) * 1000:>8.1f} "
+                f"{p99:>8.1f} {turns / elapsed:>7.1f} {errors:>7} {sum(admission.stats.values()) - shed_before:>5} {round_trips:>8.2f} {tokens:>12.0f} "
+                f"{llm_service.llm.calls - calls_before:>10} {hits:>11}"
+            )
+            if (args.max_p99_ms and p99 > args.max_p99_ms) or (args.max_round_trips and round_trips > args.max_round_trips):
+                failed = True
+            # The synthetic sessions repeat FAQ queries, so an enabled cache must serve some
+            if cache is not None and hits < args.min_cache_hits:
+                failed = True
+    finally:
+        if args.local_db:
+            await database.close_pool()
+    if failed:
+        print("Regression: a run exceeded --max-p99-ms or --max-round-trips, or fell below --min-cache-hits")
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description="RK Nature backend benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    pool_parser = subparsers.add_parser("pool", help="pooled vs unpooled database round-trips")
+    pool_parser.add_argument("--requests", type=int, default=200)
+    pool_parser.add_argument("--concurrency", type=int, default=10)
+    pool_parser.set_defaults(func=bench_pool)
+
+    llm_parser = subparsers.add_parser("llm", help="serial vs concurrent LLM calls against the fake model")
+    llm_parser.add_argument("--requests", type=int, default=50)
+    llm_parser.add_argument("--concurrency", type=int, default=50)
+    llm_parser.add_argument("--latency", type=float, default=1.0, help="seconds per fake LLM call")
+    llm_parser.set_defaults(func=bench_llm)
+
+    retrieval_parser = subparsers.add_parser("retrieval", help="prompt tokens and retrieval latency vs corpus size")
+    retrieval_parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 1000], help="copies of the content corpus")
+    retrieval_parser.add_argument("--queries", type=int, default=200)
+    retrieval_parser.set_defaults(func=bench_retrieval)
+
+    prompt_parser = subparsers.add_parser("prompt", help="build_prompt cost per request")
+    prompt_parser.add_argument("--iterations", type=int, default=10000)
+    prompt_parser.set_defaults(func=bench_prompt)
+
+    roundtrips_parser = subparsers.add_parser("roundtrips", help="count database round-trips per turn (exits 1 above --max)")
+    roundtrips_parser.add_argument("--turns", type=int, default=5)
+    roundtrips_parser.add_argument("--max", type=int, default=2)
+    roundtrips_parser.add_argument("--local-db", action="store_true",
+                                   help="use the local Postgres (DB_LOCAL_MODE=1); also counts the pool's reset per release")
+    roundtrips_parser.set_defaults(func=bench_roundtrips)
+
+    memory_parser = subparsers.add_parser("memory", help="prompt tokens vs turn count, whole transcript vs bounded memory")
+    memory_parser.add_argument("--turns", type=int, nargs="+", default=[1, 10, 50, 200])
+    memory_parser.add_argument("--iterations", type=int, default=200)
+    memory_parser.set_defaults(func=bench_memory)
+
+    routing_parser = subparsers.add_parser("routing", help="share of turns answered by each tier, and the LLM calls avoided")
+    routing_parser.add_argument("--latency", type=float, default=1.0, help="seconds per fake LLM call")
+    routing_parser.set_defaults(func=bench_routing)
+
+    load_parser = subparsers.add_parser("load", help="replay multi-turn sessions against /submit_query (exits 1 above the limits)")
+    load_parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50], help="sessions replayed at once")
+    load_parser.add_argument("--sessions", type=int, default=100, help="synthetic sessions per run")
+    load_parser.add_argument("--turns", type=int, default=5, help="turns per synthetic session")
+    load_parser.add_argument("--transcripts", help="file of chat_logs.log values, one session per line")
+    load_parser.add_argument("--latency", type=float, default=0.5, help="seconds per fake LLM call")
+    load_parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of fake LLM calls that return a 429")
+    load_parser.add_argument("--db-latency", type=float, default=0.005, help="seconds per query on the recording connection")
+    load_parser.add_argument("--no-cache", action="store_true", help="send every non-trivial turn to the fake LLM")
+    load_parser.add_argument("--local-db", action="store_true", help="use the local Postgres (DB_LOCAL_MODE=1) instead")
+    load_parser.add_argument("--max-p99-ms", type=float, help="fail if any run's p99 is above this")
+    load_parser.add_argument("--max-round-trips", type=float, help="fail if any run averages more round-trips per turn")
+    load_parser.add_argument("--min-cache-hits", type=int, default=1,
+                             help="fail if a run with the cache enabled gets fewer response cache hits (0 for --transcripts)")
+    load_parser.set_defaults(func=bench_load)
+
+    args = parser.parse_args()
+    result = args.func(args)
+    if asyncio.iscoroutine(result):
+        asyncio.run(result)
+
+if __name__ == "__main__":
+    main()
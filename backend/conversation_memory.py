@@ -0,0 +1,75 @@
+"""
+Bounded conversation memory for the prompt.
+
+A session's memory is its rolling summary plus its last MEMORY_RECENT_TURNS turns verbatim.
+Both are stored in Neon (chat_logs.summary and chat_messages); the summary is rewritten by the
+LLM every turn (or extended locally for fast-path and cached answers), and only the recent
+turns are loaded. render() fits the memory into MEMORY_TOKEN_BUDGET, so the prompt stops
+growing with session length.
+"""
+from collections import namedtuple
+from config import MEMORY_RECENT_TURNS, MEMORY_TOKEN_BUDGET, MEMORY_SUMMARY_TOKENS
+from retrieval import estimate_tokens
+
+# turns: tuple of (user_message, bot_message), oldest first
+ConversationMemory = namedtuple("ConversationMemory", ["summary", "turns"])
+
+def from_state(state):
+    """Memory for a session state from load_session_state, or None for a new session"""
+    turns = tuple(tuple(turn) for turn in (state.get('turns') or ())[-MEMORY_RECENT_TURNS:])
+    if not state.get('summary') and not turns:
+        return None
+    return ConversationMemory(state.get('summary') or "", turns)
+
+def add_turn(turns, user_message, bot_message):
+    """The recent-turn window after one more turn"""
+    return [*(turns or ()), (user_message, bot_message)][-MEMORY_RECENT_TURNS:]
+
+def cap_summary(summary, max_tokens=MEMORY_SUMMARY_TOKENS):
+    """Trim a summary to max_tokens, keeping the most recent part"""
+    summary = (summary or "").strip()
+    if estimate_tokens(summary) <= max_tokens:
+        return summary
+    tail = summary[-max_tokens * 4:]
+    # Start at a word boundary
+    return tail[tail.find(" ") + 1:]
+
+def roll_summary(memory, addition):
+    """Append to the rolling summary without an LLM call, within the summary budget"""
+    previous = memory.summary if memory else ""
+    return cap_summary(f"{previous} {addition}")
+
+def search_context(memory):
+    """The user's recent messages, as extra retrieval terms for follow-up questions"""
+    if not memory:
+        return ""
+    return " ".join(user_message for user_message, _ in memory.turns)
+
+def render(memory, token_budget=MEMORY_TOKEN_BUDGET):
+    """
+    Format memory for the prompt
+
+    The summary comes first; then as many of the most recent turns as fit in the budget.
+
+    Returns:
+        str: The rendered memory, or "" if there is none
+    """
+    if not memory:
+        return ""
+    summary = cap_summary(memory.summary, min(MEMORY_SUMMARY_TOKENS, token_budget))
+    lines = []
+    remaining = token_budget - estimate_tokens(summary)
+    for user_message, bot_message in reversed(memory.turns):
+        line = f"User: {user_message}\nBot: {bot_message}"
+        cost = estimate_tokens(line)
+        if cost > remaining:
+            break
+        lines.append(line)
+        remaining -= cost
+
+    parts = []
+    if summary:
+        parts.append(f"Summary: {summary}")
+    if lines:
+        parts.append("Recent turns:\n" + "\n".join(reversed(lines)))
+    return "\n".join(parts)
@@ -1,171 +1,288 @@
+import os
+import json
 import sqlite3
+import asyncio
+import threading
 import asyncpg
 import logging
-from config import NEON_DB_USER, NEON_DB_PASSWORD, NEON_DB_HOST, NEON_DB_PORT, NEON_DB_NAME, SQLITE_DB_PATH
-from functools import lru_cache
+from collections import namedtuple
+from contextlib import asynccontextmanager
+from config import (
+    NEON_DB_USER, NEON_DB_PASSWORD, NEON_DB_HOST, NEON_DB_PORT, NEON_DB_NAME, SQLITE_DB_PATH,
+    NEON_POOL_MIN_SIZE, NEON_POOL_MAX_SIZE, NEON_POOL_ACQUIRE_TIMEOUT,
+    NEON_POOL_MAX_INACTIVE_LIFETIME, NEON_POOL_PING_ON_ACQUIRE,
+    DB_LOCAL_MODE, LOCAL_PG_DSN, RUN_MIGRATIONS_ON_STARTUP, CONTENT_REFRESH_INTERVAL,
+    MEMORY_RECENT_TURNS
+)
+from retrieval import RetrievalIndex
+from migrations import migrate
+import metrics
 
 
+def _connection_kwargs():
+    """Connection settings for Neon, or for the local Postgres in local test mode"""
+    if DB_LOCAL_MODE:
+        return {"dsn": LOCAL_PG_DSN}
+    return {
+        "user": NEON_DB_USER,
+        "password": NEON_DB_PASSWORD,
+        "database": NEON_DB_NAME,
+        "host": NEON_DB_HOST,
+        "port": NEON_DB_PORT
+    }
+
 # PostgreSQL (Neon) Connection
 async def connect_to_neon():
-    conn = await asyncpg.connect(
-        user=NEON_DB_USER,
-        password=NEON_DB_PASSWORD,
-        database=NEON_DB_NAME,
-        host=NEON_DB_HOST,
-        port=NEON_DB_PORT
-    )
+    """Open a standalone connection (unpooled; used by scripts and benchmarks)"""
+    conn = await asyncpg.connect(**_connection_kwargs())
     return conn
 
-# Chat Logging Functions
-async def log_chat(session_id, log_entry):
-    conn = await connect_to_neon()
-    try:
-        existing_row = await conn.fetchrow(
-            "SELECT log FROM chat_logs WHERE session_id = $1", session_id
-        )
-        
-        if existing_row:
-            existing_log = existing_row['log']
-            updated_log = f"{existing_log} | {log_entry}"
-            await conn.execute(
-                "UPDATE chat_logs SET log = $1 WHERE session_id = $2",
-                updated_log, session_id
-            )
-        else:
-            await conn.execute(
-                "INSERT INTO chat_logs (session_id, log, summary) VALUES ($1, $2, $3)",
-                session_id, log_entry, ""
-            )
-    finally:
-        await conn.close()
+# Connection Pool
+_pool = None
+round_trips = 0  # queries sent by pooled connections since startup
 
-async def update_summary(session_id, summary):
-    conn = await connect_to_neon()
-    try:
-        await conn.execute(
-            "UPDATE chat_logs SET summary = $1 WHERE session_id = $2",
-            summary, session_id
-        )
-    finally:
-        await conn.close()
+def _count_round_trip(record):
+    global round_trips
+    round_trips += 1
+    metrics.count_round_trip()
 
-async def get_chat_data(session_id):
-    conn = await connect_to_neon()
-    try:
-        row = await conn.fetchrow(
-            "SELECT log, summary FROM chat_logs WHERE session_id = $1", session_id
-        )
-        return row
-    finally:
-        await conn.close()
+async def _init_connection(conn):
+    conn.add_query_logger(_count_round_trip)
 
-# User Information Functions
-async def get_user_info(session_id):
-    conn = await connect_to_neon()
-    try:
-        # Check if user_info table exists
-        table_exists = await conn.fetchval(
-            "SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = 'user_info')"
-        )
-        
-        if not table_exists:
-            # Create the table if it doesn't exist
-            await conn.execute("""
-                CREATE TABLE user_info (
-                    session_id TEXT PRIMARY KEY,
-                    keyword_id INTEGER,
-                    name TEXT,
-                    phone TEXT,
-                    template TEXT
-                )
-            """)
-            return {}
-        
-        # Get user info
-        row = await conn.fetchrow(
-            "SELECT keyword_id, name, phone, template FROM user_info WHERE session_id = $1", 
-            session_id
+async def _ping_connection(conn):
+    await conn.fetchval("SELECT 1")
+
+_pool_lock = asyncio.Lock()
+
+async def init_pool():
+    """
+    Create the process-wide connection pool and migrate the schema
+    
+    Call once at startup, on the serving event loop. The pool is only published once the
+    migrations succeeded; on failure it is closed and the error raised, so the next call
+    tries again.
+    
+    Raises:
+        MigrationError: A schema migration failed
+    """
+    global _pool
+    async with _pool_lock:
+        if _pool is not None:
+            return _pool
+        pool = await asyncpg.create_pool(
+            min_size=NEON_POOL_MIN_SIZE,
+            max_size=NEON_POOL_MAX_SIZE,
+            max_inactive_connection_lifetime=NEON_POOL_MAX_INACTIVE_LIFETIME,
+            init=_init_connection,
+            setup=_ping_connection if NEON_POOL_PING_ON_ACQUIRE else None,
+            **_connection_kwargs()
         )
-        
-        if row:
-            return {
-                'keyword_id': row['keyword_id'],
-                'name': row['name'],
-                'phone': row['phone'],
-                'template': row['template']
-            }
-        return {}
-    except Exception as e:
-        logging.error(f"Error getting user info: {e}")
-        return {}
-    finally:
-        await conn.close()
+        try:
+            if RUN_MIGRATIONS_ON_STARTUP:
+                async with pool.acquire() as conn:
+                    await migrate(conn)
+        except BaseException:
+            await pool.close()
+            raise
+        _pool = pool
+        logging.info(f"Database pool ready (min={NEON_POOL_MIN_SIZE}, max={NEON_POOL_MAX_SIZE}, local={DB_LOCAL_MODE})")
+        return _pool
 
-async def update_user_info(session_id, user_info):
-    conn = await connect_to_neon()
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+async def check_pool_health():
+    """Return True if a pooled connection can run a trivial query"""
     try:
-        # Check if user_info table exists
-        table_exists = await conn.fetchval(
-            "SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = 'user_info')"
-        )
-        
-        if not table_exists:
-            # Create the table if it doesn't exist
-            await conn.execute("""
-                CREATE TABLE user_info (
-                    session_id TEXT PRIMARY KEY,
-                    keyword_id INTEGER,
-                    name TEXT,
-                    phone TEXT,
-                    template TEXT
-                )
-            """)
-        
-        # Check if record exists
-        existing = await conn.fetchval(
-            "SELECT EXISTS (SELECT 1 FROM user_info WHERE session_id = $1)",
-            session_id
-        )
-        
-        if existing:
-            # Update existing record
-            await conn.execute("""
-                UPDATE user_info 
-                SET keyword_id = $1, name = $2, phone = $3, template = $4
-                WHERE session_id = $5
-            """, 
-            user_info.get('keyword_id'), 
-            user_info.get('name'), 
-            user_info.get('phone'), 
-            user_info.get('template'), 
-            session_id)
-        else:
-            # Insert new record
-            await conn.execute("""
-                INSERT INTO user_info (session_id, keyword_id, name, phone, template)
-                VALUES ($1, $2, $3, $4, $5)
-            """, 
-            session_id,
-            user_info.get('keyword_id'), 
-            user_info.get('name'), 
-            user_info.get('phone'), 
-            user_info.get('template'))
-        
-        # logging.info(f"User info updated for session {session_id}")
+        async with acquire() as conn:
+            await _ping_connection(conn)
+        return True
     except Exception as e:
-        logging.error(f"Error updating user info: {e}")
-    finally:
-        await conn.close()
-        
+        logging.error(f"Database health check failed: {e}")
+        return False
+
+@asynccontextmanager
+async def acquire():
+    """Check a connection out of the shared pool, creating the pool on first use"""
+    pool = _pool or await init_pool()
+    async with pool.acquire(timeout=NEON_POOL_ACQUIRE_TIMEOUT) as conn:
+        yield conn
+
+# Chat Logging Functions
+# Turns are appended to chat_messages (one row per turn); chat_logs keeps one row per
+# session with the summary, a turn counter and the legacy concatenated log of older turns.
+# Tables are created by migrations.py.
+
+RECENT_TURNS_SQL = """
+    SELECT json_agg(json_build_array(m.user_message, m.bot_message) ORDER BY m.turn_index)
+    FROM (
+        SELECT turn_index, user_message, bot_message FROM chat_messages
+        WHERE session_id = $1 ORDER BY turn_index DESC LIMIT $2
+    ) m
+"""
+
+# Session State Functions
+async def load_session_state(session_id, last_n=MEMORY_RECENT_TURNS):
+    """
+    Load everything a turn needs in one round-trip
+    
+    Only the rolling summary and the last few turns are read, not the whole transcript
+    (see conversation_memory).
+    
+    Args:
+        session_id (str): The chat session
+        last_n (int): Number of recent turns to include
+    
+    Returns:
+        dict: {'name', 'phone', 'summary', 'turns'}; turns is a list of
+            (user_message, bot_message), oldest first
+    """
+    async with acquire() as conn:
+        row = await conn.fetchrow(f"""
+            SELECT u.name, u.phone, c.summary, ({RECENT_TURNS_SQL}) AS recent_turns
+            FROM (SELECT $1::text AS session_id) s
+            LEFT JOIN user_info u ON u.session_id = s.session_id
+            LEFT JOIN chat_logs c ON c.session_id = s.session_id
+        """, session_id, last_n)
+    return {
+        'name': row['name'],
+        'phone': row['phone'],
+        'summary': row['summary'],
+        'turns': [tuple(turn) for turn in json.loads(row['recent_turns'])] if row['recent_turns'] else []
+    }
+
+async def save_session_state(session_id, name, phone, summary, user_message, bot_message):
+    """Persist a turn (user details, summary and messages) atomically in one statement"""
+    async with acquire() as conn:
+        await conn.execute("""
+            WITH user_row AS (
+                INSERT INTO user_info (session_id, name, phone)
+                VALUES ($1, $2, $3)
+                ON CONFLICT (session_id) DO UPDATE
+                SET name = EXCLUDED.name, phone = EXCLUDED.phone
+            ), session AS (
+                INSERT INTO chat_logs (session_id, log, summary, turn_count, updated_at)
+                VALUES ($1, '', $4, 1, now())
+                ON CONFLICT (session_id) DO UPDATE
+                SET summary = EXCLUDED.summary, turn_count = chat_logs.turn_count + 1, updated_at = now()
+                RETURNING turn_count
+            )
+            INSERT INTO chat_messages (session_id, turn_index, user_message, bot_message)
+            SELECT $1, turn_count, $5, $6 FROM session
+        """, session_id, name, phone, summary, user_message, bot_message)
+
+async def save_session_states(turns):
+    """
+    Persist a batch of turns with multi-row upserts in one statement
+    
+    Several turns of the same session are allowed: user_info and chat_logs take the
+    latest values, and the messages get consecutive turn indexes in batch order.
+    
+    Args:
+        turns (list): Dicts with session_id, name, phone, summary, user_message, bot_message
+    """
+    columns = ('session_id', 'name', 'phone', 'summary', 'user_message', 'bot_message')
+    arrays = [[turn[column] for turn in turns] for column in columns]
+    async with acquire() as conn:
+        await conn.execute("""
+            WITH turns AS (
+                SELECT * FROM unnest($1::text[], $2::text[], $3::text[], $4::text[], $5::text[], $6::text[])
+                    WITH ORDINALITY AS t(session_id, name, phone, summary, user_message, bot_message, seq)
+            ), latest AS (
+                SELECT DISTINCT ON (session_id) session_id, name, phone, summary
+                FROM turns ORDER BY session_id, seq DESC
+            ), counts AS (
+                SELECT session_id, count(*)::int AS turns FROM turns GROUP BY session_id
+            ), user_rows AS (
+                INSERT INTO user_info (session_id, name, phone)
+                SELECT session_id, name, phone FROM latest
+                ON CONFLICT (session_id) DO UPDATE
+                SET name = EXCLUDED.name, phone = EXCLUDED.phone
+            ), sessions AS (
+                INSERT INTO chat_logs (session_id, log, summary, turn_count, updated_at)
+                SELECT l.session_id, '', l.summary, c.turns, now()
+                FROM latest l JOIN counts c USING (session_id)
+                ON CONFLICT (session_id) DO UPDATE
+                SET summary = EXCLUDED.summary,
+                    turn_count = chat_logs.turn_count + EXCLUDED.turn_count,
+                    updated_at = now()
+                RETURNING session_id, turn_count
+            )
+            INSERT INTO chat_messages (session_id, turn_index, user_message, bot_message)
+            SELECT t.session_id,
+                   s.turn_count - c.turns + row_number() OVER (PARTITION BY t.session_id ORDER BY t.seq),
+                   t.user_message, t.bot_message
+            FROM turns t
+            JOIN sessions s USING (session_id)
+            JOIN counts c USING (session_id)
+        """, *arrays)
+
 # SQLite Content Database Functions
-@lru_cache(maxsize=1)  # Cache only the most recent result
-def fetch_keywords_data():
+# The content and everything derived from it are held in one immutable snapshot, swapped in
+# whole when the database file changes, so requests never see a half-reloaded state.
+ContentSnapshot = namedtuple("ContentSnapshot", ["version", "data", "index"])
+
+_content = None
+_content_lock = threading.Lock()
+
+def content_version():
+    """Cheap change marker for the content database: mtime and size of the file and its WAL"""
+    version = []
+    for path in (SQLITE_DB_PATH, f"{SQLITE_DB_PATH}-wal"):
+        try:
+            stat = os.stat(path)
+            version.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            version.append(None)
+    return tuple(version)
+
+def _load_content():
+    version = content_version()
     conn = sqlite3.connect(SQLITE_DB_PATH)
     cursor = conn.cursor()
     cursor.execute("SELECT id, keywords, content FROM extracted_data")
     records = cursor.fetchall()
     conn.close()
-    return {record[0]: {"keyword": record[1], "content": record[2]} for record in records}
+    data = {record[0]: {"keyword": record[1], "content": record[2]} for record in records}
+    return ContentSnapshot(version, data, RetrievalIndex(data))
+
+def get_content():
+    """The current content snapshot, loaded on first use"""
+    global _content
+    if _content is None:
+        with _content_lock:
+            if _content is None:
+                _content = _load_content()
+    return _content
+
+def refresh_content():
+    """Reload the snapshot if the content database changed. Returns True if it was reloaded."""
+    global _content
+    with _content_lock:
+        if _content is not None and _content.version == content_version():
+            return False
+        _content = _load_content()
+    logging.info(f"Loaded content version {_content.version} ({len(_content.data)} records)")
+    return True
+
+async def watch_content(interval=CONTENT_REFRESH_INTERVAL):
+    """Background task: poll for content changes and rebuild the snapshot off the event loop"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(refresh_content)
+        except Exception as e:
+            logging.error(f"Content refresh failed: {e}")
+
+def fetch_keywords_data():
+    return get_content().data
+
+def get_content_index():
+    """Retrieval index over the current content"""
+    return get_content().index
 
 def get_content_by_id(content_id):
     data_dict = fetch_keywords_data()
@@ -0,0 +1,60 @@
+import asyncio
+import random
+import time
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+# Canned reply in the JSON format of llm_output
+FAKE_RESPONSE = (
+    '{"name": "", "phone": "", "template": "General", '
+    '"summary": "The user asked a general question about RK Nature Cure Home.", '
+    '"response": "Thank you for reaching out to RK Nature Cure Home! How can we help you today?"}'
+)
+
+class FakeRateLimitError(Exception):
+    """Simulated provider quota error; llm_service retries it like a real 429"""
+    code = 429
+
+class FakeLLM:
+    """
+    Offline stand-in for the Gemini chat model, for benchmarks and local runs
+
+    Args:
+        latency (float): Seconds each call takes
+        response (str, optional): Text returned by every call
+        error_rate (float): Fraction of calls that fail with FakeRateLimitError
+    """
+
+    def __init__(self, latency=1.0, response=FAKE_RESPONSE, error_rate=0.0):
+        self.latency = latency
+        self.response = response
+        self.error_rate = error_rate
+        self.calls = 0
+        self.errors = 0
+
+    def _maybe_fail(self):
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors += 1
+            raise FakeRateLimitError("429 Resource exhausted (simulated)")
+
+    def invoke(self, prompt):
+        self.calls += 1
+        time.sleep(self.latency)
+        self._maybe_fail()
+        return AIMessage(content=self.response)
+
+    async def ainvoke(self, prompt):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        self._maybe_fail()
+        return AIMessage(content=self.response)
+
+    async def astream(self, prompt):
+        """Yield the response a few words at a time, spreading the latency across chunks"""
+        self.calls += 1
+        self._maybe_fail()
+        words = self.response.split(" ")
+        chunks = [" ".join(words[i:i + 3]) + " " for i in range(0, len(words), 3)]
+        chunks[-1] = chunks[-1].rstrip(" ")
+        for chunk in chunks:
+            await asyncio.sleep(self.latency / len(chunks))
+            yield AIMessageChunk(content=chunk)
@@ -0,0 +1,161 @@
+"""
+Rule-based pre-classifier that runs before the LLM.
+
+It extracts Indian phone numbers and names locally, and answers trivial turns
+(greetings, thanks, goodbyes, or messages that only share a name/number) from
+templates without an LLM call.
+"""
+import re
+import logging
+from functools import lru_cache
+from database import get_content
+from prompt_builder import TEMPLATE_CHOICES
+from conversation_memory import roll_summary
+
+# +91 / 91 / 0 prefix optional, then a 10-digit mobile number starting with 6-9
+PHONE_PATTERN = re.compile(r"(?<![\d+])(?:\+?91[\s-]?|0)?([6-9]\d{4})[\s-]?(\d{5})(?!\d)")
+NAME_INTRO_PATTERN = re.compile(
+    r"\b(?:my name is|my name's|name is)\s+([a-z][a-z.]*(?:\s+[a-z][a-z.]*)?)",
+    re.IGNORECASE
+)
+# "I'm worried", "its very painful": these intros only introduce a name that is capitalised
+AMBIGUOUS_INTROS = r"(?i:i am|i'm|im|this is|call me|it's|its)"
+AMBIGUOUS_INTRO_PATTERN = re.compile(rf"\b{AMBIGUOUS_INTROS}\s+([A-Z][a-z.]*(?:\s+[A-Z][a-z.]*)?)")
+WORD_PATTERN = re.compile(r"[a-z']+")
+
+GREETINGS = {"hi", "hii", "hello", "hey", "namaste", "vanakkam", "good morning", "good afternoon", "good evening"}
+THANKS = {"thanks", "thank you", "thank u", "thanks a lot", "thank you so much", "ty"}
+GOODBYES = {"bye", "goodbye", "good night", "see you", "bye bye"}
+
+# Words that can share a message with a name or number without asking anything
+FILLER_WORDS = {
+    "my", "name", "is", "number", "phone", "mobile", "no", "contact", "here", "and", "it's", "its",
+    "this", "i", "am", "i'm", "im", "call", "me", "sir", "madam", "mam", "ma'am", "please", "pls", "ok",
+    "okay", "sure", "yes", "the", "s"
+}
+# Words that are never a name (on top of the content vocabulary and template names)
+NOT_NAMES = FILLER_WORDS | {
+    "hi", "hello", "hey", "thanks", "thank", "you", "bye", "good", "morning", "evening", "what", "where",
+    "when", "how", "why", "who", "which", "can", "do", "does", "need", "want", "looking", "having",
+    "suffering", "from", "interested", "not", "fine", "well", "doing", "a", "an", "in", "for", "with",
+    "pain", "price", "cost", "fees", "charges", "timings", "doctor", "treatment", "therapy", "booking",
+    "very", "painful", "worried", "sick", "tired", "stressed", "diabetic", "diabetes", "sugar", "bp",
+    "migraine", "headache", "fever", "cold", "cough", "back", "knee", "obese", "weight"
+}
+
+REPLIES = {
+    "greeting": "Hello{name}! Welcome to RK Nature Cure Home. How can we help you today?",
+    "thanks": "You're welcome{name}! Is there anything else we can help you with?",
+    "goodbye": "Thank you for reaching out to RK Nature Cure Home{name}. Take care!",
+    "details": "Thank you{name}! How can we help you today?",
+}
+
+stats = {"turns": 0, "answered_locally": 0, "details_extracted": 0}
+
+def normalize_phone(text):
+    """Return the first Indian mobile number in the text as 10 digits, or None"""
+    match = PHONE_PATTERN.search(text)
+    return match.group(1) + match.group(2) if match else None
+
+@lru_cache(maxsize=1)
+def _index_vocabulary(index):
+    return frozenset(index.idf) | {template.lower() for template in TEMPLATE_CHOICES}
+
+def _vocabulary():
+    # Rebuilt only when the content (and with it the index) is reloaded
+    return _index_vocabulary(get_content().index)
+
+def _looks_like_name(words, vocabulary):
+    return 0 < len(words) <= 2 and all(
+        word.isalpha() and len(word) > 1 and word not in NOT_NAMES and word not in vocabulary
+        for word in words
+    )
+
+def extract_name(text):
+    """
+    Find a name the user introduces explicitly ("my name is ...", "I'm ...")
+    
+    A bare one- or two-word reply is never taken as a name here: "Tomorrow", "Chennai" or
+    "Panchakarma" look just like names, so those turns are left to the LLM.
+    
+    Args:
+        text (str): The user's message
+    
+    Returns:
+        str: The name, capitalised, or None
+    """
+    vocabulary = _vocabulary()
+    match = NAME_INTRO_PATTERN.search(text) or AMBIGUOUS_INTRO_PATTERN.search(text)
+    if match:
+        words = match.group(1).lower().split()
+        # "I am Ravi and ..." -> stop at the first word that can't be part of a name
+        for end in range(len(words), 0, -1):
+            if _looks_like_name(words[:end], vocabulary):
+                return " ".join(words[:end]).title()
+    return None
+
+def _matches(phrase_set, text):
+    return " ".join(WORD_PATTERN.findall(text.lower())) in phrase_set
+
+def classify_turn(user_query, name=None, phone=None):
+    """
+    Classify a turn and extract details locally
+    
+    Args:
+        user_query (str): The user's message
+        name (str, optional): Known name; a known name is never replaced by a local guess
+        phone (str, optional): Known phone
+    
+    Returns:
+        dict: kind ("greeting", "thanks", "goodbye", "details" or "query"),
+            name and phone found in the message (or None)
+    """
+    found_phone = normalize_phone(user_query)
+    found_name = extract_name(user_query) if name is None else None
+
+    if _matches(GREETINGS, user_query):
+        kind = "greeting"
+    elif _matches(THANKS, user_query):
+        kind = "thanks"
+    elif _matches(GOODBYES, user_query):
+        kind = "goodbye"
+    else:
+        # Only details (plus filler and greetings) left once the name and number are removed?
+        rest = PHONE_PATTERN.sub(" ", user_query.lower())
+        if found_name:
+            rest = re.sub(r"\b" + re.escape(found_name.lower()) + r"\b", " ", rest)
+        words = [word for word in WORD_PATTERN.findall(rest) if word not in FILLER_WORDS and word not in GREETINGS]
+        kind = "details" if (found_name or found_phone) and not words else "query"
+
+    return {"kind": kind, "name": found_name, "phone": found_phone}
+
+def answer_locally(user_query, memory=None, name=None, phone=None):
+    """
+    Answer trivial turns from templates, without the LLM
+    
+    Returns:
+        tuple: (classification, answer) where answer is (name, phone, summary, response)
+            like process_user_query, or None if the turn needs the LLM
+    """
+    classification = classify_turn(user_query, name, phone)
+    stats["turns"] += 1
+    if classification["name"] or classification["phone"]:
+        stats["details_extracted"] += 1
+    if classification["kind"] == "query":
+        return classification, None
+
+    stats["answered_locally"] += 1
+    new_name = classification["name"]
+    new_phone = classification["phone"]
+    known_name = new_name or name
+    response = REPLIES[classification["kind"]].format(name=f", {known_name}" if known_name else "")
+
+    summary = memory.summary if memory else ""
+    if classification["kind"] == "details":
+        summary = roll_summary(memory, f"User: {known_name or 'Unknown'}, Phone: {new_phone or phone or 'Unknown'}")
+    logging.info("Answered %s turn without the LLM (%.0f%% of turns so far)", classification['kind'], llm_avoided_rate() * 100)
+    return classification, (new_name, new_phone, summary, response)
+
+def llm_avoided_rate():
+    """Fraction of turns answered without an LLM call"""
+    return stats["answered_locally"] / stats["turns"] if stats["turns"] else 0.0
@@ -0,0 +1,193 @@
+"""
+JSON output contract for the LLM.
+
+The model is asked for one JSON object (OUTPUT_SCHEMA; Gemini enforces it through
+response_schema) and parse_llm_output validates it with a single json.loads. Output that
+doesn't parse goes through cheap local repairs, in order:
+    1. strip code fences / surrounding prose and parse the outermost {...}
+    2. close a truncated object (unterminated string, missing braces)
+    3. read the legacy "Name:/Phone:/Template:/Summary:/Response:" text format
+Only if all of them fail is the generic fallback reply used. stats counts each outcome.
+"""
+import re
+import json
+import logging
+from prompt_builder import TEMPLATE_CHOICES
+
+FALLBACK_RESPONSE = "I'm here to help you with information about RK Nature Cure Home. How can I assist you today?"
+
+# Field order doesn't matter: under response_schema Gemini emits the properties alphabetically
+# (no propertyOrdering is set), and ResponseFieldStream finds "response" wherever it appears
+OUTPUT_FIELDS = ("name", "phone", "template", "summary", "response")
+OUTPUT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string"},
+        "phone": {"type": "string"},
+        "template": {"type": "string", "enum": list(TEMPLATE_CHOICES)},
+        "summary": {"type": "string"},
+        "response": {"type": "string"},
+    },
+    "required": ["template", "summary", "response"],
+}
+
+UNKNOWN_VALUES = {"", "unknown", "none", "null", "n/a"}
+LEGACY_FIELD_PATTERN = re.compile(r"^(Name|Phone|Template|Summary|Response):\s*", re.MULTILINE)
+
+stats = {"parsed": 0, "repaired": 0, "failed": 0}
+
+def _validate(data):
+    """The output fields if data satisfies the contract, else None"""
+    if not isinstance(data, dict) or not isinstance(data.get("response"), str) or not data["response"].strip():
+        return None
+    fields = {}
+    for field in OUTPUT_FIELDS:
+        value = data.get(field)
+        if value is not None and not isinstance(value, str):
+            value = str(value)
+        fields[field] = value.strip() if value else ""
+    return fields
+
+def _loads(text):
+    try:
+        return json.loads(text, strict=False)
+    except ValueError:
+        return None
+
+def _close_truncated(text):
+    """Terminate an unfinished string and close open objects (output cut off mid-reply)"""
+    in_string = escaped = False
+    depth = 0
+    for char in text:
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = in_string
+        elif char == '"':
+            in_string = not in_string
+        elif not in_string and char == "{":
+            depth += 1
+        elif not in_string and char == "}":
+            depth -= 1
+    if depth <= 0 and not in_string:
+        return None
+    return text.rstrip("\\") + ('"' if in_string else "") + "}" * max(depth, 1)
+
+def _parse_legacy(text):
+    parts = LEGACY_FIELD_PATTERN.split(text)
+    # ["", "Name", "value", "Phone", "value", ...]
+    fields = {parts[i].lower(): parts[i + 1].strip() for i in range(1, len(parts) - 1, 2)}
+    return fields if fields.get("response") else None
+
+def _repair(text):
+    start = text.find("{")
+    if start != -1:
+        end = text.rfind("}")
+        for candidate in (text[start:end + 1] if end > start else None, _close_truncated(text[start:])):
+            fields = _validate(_loads(candidate)) if candidate else None
+            if fields:
+                return fields
+    return _validate(_parse_legacy(text))
+
+def _known(value):
+    return None if value.lower() in UNKNOWN_VALUES else value
+
+def parse_llm_output(ai_response):
+    """
+    Validate the model's JSON output, repairing it locally if needed
+
+    Returns:
+        dict: name, phone (None if unknown), template, summary, response
+            and repaired (True if the output didn't follow the contract)
+    """
+    fields = _validate(_loads(ai_response))
+    repaired = fields is None
+    if fields:
+        stats["parsed"] += 1
+    else:
+        fields = _repair(ai_response)
+        if fields:
+            stats["repaired"] += 1
+            logging.warning("Repaired malformed LLM output (%.1f%% unparsed so far)", parse_failure_rate() * 100)
+        else:
+            stats["failed"] += 1
+            logging.error("Unusable LLM output, sending the fallback reply: %r", ai_response[:200])
+            fields = dict.fromkeys(OUTPUT_FIELDS, "")
+
+    return {
+        'name': _known(fields['name']),
+        'phone': _known(fields['phone']),
+        'template': fields['template'] or "General",
+        'summary': fields['summary'],
+        'response': fields['response'] or FALLBACK_RESPONSE,
+        'repaired': repaired
+    }
+
+def parse_failure_rate():
+    """Fraction of outputs that needed a repair or could not be used"""
+    total = sum(stats.values())
+    return (stats["repaired"] + stats["failed"]) / total if total else 0.0
+
+class ResponseFieldStream:
+    """
+    Pull the "response" string out of streamed JSON as it arrives
+
+    feed() returns the newly decoded part of the reply (possibly ""). Escape sequences
+    split across chunks are held back until complete.
+    """
+    KEY_PATTERN = re.compile(r'"response"\s*:\s*"')
+    PARTIAL_UNICODE_ESCAPE = re.compile(r'\\u[0-9a-fA-F]{0,3}$')
+
+    def __init__(self):
+        self.buffer = ""
+        self.start = None
+        self.emitted = 0
+        self.complete = False
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        if self.complete:
+            return ""
+        if self.start is None:
+            match = self.KEY_PATTERN.search(self.buffer)
+            if not match:
+                return ""
+            self.start = match.end()
+
+        raw = self.buffer[self.start:]
+        end = self._closing_quote(raw)
+        if end is None:
+            raw = self._trim_partial_escape(raw)
+        else:
+            raw = raw[:end]
+            self.complete = True
+        text = _loads(f'"{raw}"')
+        if text is None:
+            return ""
+        new_text = text[self.emitted:]
+        self.emitted = len(text)
+        return new_text
+
+    @classmethod
+    def _trim_partial_escape(cls, raw):
+        trailing = len(raw) - len(raw.rstrip("\\"))
+        if trailing % 2:
+            return raw[:-1]
+        match = cls.PARTIAL_UNICODE_ESCAPE.search(raw)
+        if match:
+            before = raw[:match.start()]
+            if (len(before) - len(before.rstrip("\\"))) % 2 == 0:
+                return before
+        return raw
+
+    @staticmethod
+    def _closing_quote(raw):
+        escaped = False
+        for index, char in enumerate(raw):
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                return index
+        return None
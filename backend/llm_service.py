@@ -1,69 +1,265 @@
-import re
+import time
+import asyncio
 import logging
+import random
+from concurrent.futures import ThreadPoolExecutor
 from langchain_google_genai import ChatGoogleGenerativeAI
-from config import GOOGLE_API_KEY, LLM_MODEL
-from prompt_builder import build_prompt
+from config import (
+    GOOGLE_API_KEY, LLM_MODEL, LLM_BACKEND, LLM_TIMEOUT, LLM_MAX_CONCURRENCY,
+    LLM_MAX_RETRIES, LLM_RETRY_BASE_DELAY, LLM_USE_EXECUTOR, FAKE_LLM_LATENCY, FAKE_LLM_ERROR_RATE
+)
+from prompt_builder import build_prompt, TEMPLATE_CHOICES
+from llm_output import OUTPUT_SCHEMA, ResponseFieldStream, parse_llm_output
+from response_cache import response_cache
+from fast_path import answer_locally
+from conversation_memory import roll_summary, cap_summary
+from retrieval import estimate_tokens
+import router
+import metrics
+import log_setup
+from database import get_content
+
+def create_llm():
+    """Create the configured chat model (Gemini, or the offline fake)"""
+    if LLM_BACKEND == "fake":
+        from fake_llm import FakeLLM
+        return FakeLLM(latency=FAKE_LLM_LATENCY, error_rate=FAKE_LLM_ERROR_RATE)
+    # Rate-limit retries are handled by invoke_llm, so the client makes a single attempt.
+    # Output is constrained to the JSON contract in llm_output (needs langchain_google_genai>=2.1.6).
+    return ChatGoogleGenerativeAI(
+        model=LLM_MODEL, google_api_key=GOOGLE_API_KEY, max_retries=1,
+        response_mime_type="application/json", response_schema=OUTPUT_SCHEMA
+    )
 
 # Initialize LLM
-llm = ChatGoogleGenerativeAI(model=LLM_MODEL, google_api_key=GOOGLE_API_KEY)
+llm = create_llm()
+
+# Bounds concurrent LLM calls per worker; the executor is only used when LLM_USE_EXECUTOR is set
+llm_slots = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+llm_executor = ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY, thread_name_prefix="llm") if LLM_USE_EXECUTOR else None
+
+def is_rate_limit_error(error):
+    """Return True for provider quota / rate-limit errors (HTTP 429, ResourceExhausted)"""
+    if getattr(error, "code", None) == 429 or type(error).__name__ == "ResourceExhausted":
+        return True
+    message = str(error).lower()
+    return "429" in message or "resource exhausted" in message or "rate limit" in message
 
-async def process_user_query(user_query, bulk_content, chat_summary=None, name=None, phone=None):
+async def _call_llm(prompt):
+    if llm_executor is not None:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(llm_executor, llm.invoke, prompt)
+    return await llm.ainvoke(prompt)
+
+async def invoke_llm(prompt):
     """
-    Process user query and generate all needed data in a single API call
+    Call the LLM without blocking the event loop
+    
+    Each attempt holds a concurrency slot and is bounded by LLM_TIMEOUT. Rate-limit
+    errors are retried up to LLM_MAX_RETRIES times with full-jitter exponential backoff.
     
     Args:
-        user_query (str): The user's query
-        bulk_content (dict): Dictionary of all content with ID as key
-        chat_summary (str, optional): Summary of the chat conversation so far
-        name (str, optional): User's name if known
-        phone (str, optional): User's phone if known
+        prompt (str): The complete prompt
     
     Returns:
-        tuple: (name, phone, summary, response)
+        str: The raw model output
+    """
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        try:
+            async with llm_slots:
+                message = await asyncio.wait_for(_call_llm(prompt), timeout=LLM_TIMEOUT)
+            return message.content
+        except Exception as e:
+            if attempt == LLM_MAX_RETRIES or not is_rate_limit_error(e):
+                raise
+            delay = random.uniform(0, LLM_RETRY_BASE_DELAY * 2 ** attempt)
+            logging.warning(f"LLM rate limited (attempt {attempt + 1}), retrying in {delay:.2f}s: {e}")
+            await asyncio.sleep(delay)
+
+async def stream_llm(prompt):
+    """
+    Stream the LLM output as text chunks
+    
+    Rate-limit errors before the first chunk are retried like in invoke_llm; LLM_TIMEOUT
+    bounds the wait for each chunk.
+    
+    Yields:
+        str: Pieces of the raw model output
+    """
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        started = False
+        try:
+            async with llm_slots:
+                stream = llm.astream(prompt).__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(stream.__anext__(), timeout=LLM_TIMEOUT)
+                    except StopAsyncIteration:
+                        return
+                    started = True
+                    yield chunk.content
+        except Exception as e:
+            if started or attempt == LLM_MAX_RETRIES or not is_rate_limit_error(e):
+                raise
+            delay = random.uniform(0, LLM_RETRY_BASE_DELAY * 2 ** attempt)
+            logging.warning(f"LLM rate limited (attempt {attempt + 1}), retrying in {delay:.2f}s: {e}")
+            await asyncio.sleep(delay)
+
+def _cached_answer(user_query, content_version, memory):
+    if response_cache is None:
+        return None
+    cached = response_cache.get(user_query, content_version)
+    if cached is None:
+        return None
+    logging.info("Response cache hit - Template: %s", cached['template'])
+    return None, None, _extend_summary(memory, user_query), cached['response']
+
+def _cache_answer(user_query, content_version, known_name, parsed):
+    # Only cache well-formed answers that aren't personalised for this user. Whether the
+    # answer depends on the conversation is judged from the query (response_cache.is_cacheable):
+    # nearly every session has memory by its first question, if only of a greeting
+    if response_cache is None or parsed['repaired'] or parsed['name'] or parsed['phone']:
+        return
+    if known_name and known_name.lower() in parsed['response'].lower():
+        return
+    response_cache.put(user_query, content_version, {'template': parsed['template'], 'response': parsed['response']})
+
+def _answer_without_llm(user_query, memory, name, phone):
+    """
+    Try the cheap tiers in order (see router)
+    
+    Returns:
+        tuple: (details, answer, tier); answer is None if the turn needs the LLM
     """
-    # Get available templates
-    template_choices = [
-        "Hello", "Introduction", "AboutUs", "HealthIssueGeneral",
-        "BackPain", "JointPain", "Stress", "Diabetes", "Location", 
-        "OurContactDetails", "Directions", "TherapyOptions", "OnlineServices", 
-        "Accommodation", "Appointment", "BookingProcess", "FirstVisitInfo", 
-        "Pricing", "Insurance", "Packages", "TreatmentDuration", "ShortStay",
-        "Follow-up", "HomeRemedies", "YogaPrograms", "Diet", "DietaryGuidance", 
-        "DetoxPrograms", "SafetyProtocols", "Covid", "Hours", "Doctors", 
-        "Consultation", "FirstVisit", "Wellness", "Treatment", "Emergency", 
-        "Testimonials", "General", "Unknown"
-    ]
+    # Trivial turns (greetings, thanks, just a name or number) are answered without the LLM
+    details, answer = answer_locally(user_query, memory, name, phone)
+    if answer is not None:
+        return details, answer, "local"
     
-    # Build prompt
-    prompt = build_prompt(user_query, bulk_content, template_choices, chat_summary, name, phone)
+    # Address, hours and contact questions are filled from fixed templates
+    answer = router.answer_from_template(user_query, memory, name, phone)
+    if answer is not None:
+        return details, (details['name'], details['phone'], *answer[2:]), "template"
     
-    # Log prompt for debugging
-    logging.debug(f"Prompt sent to LLM: {prompt}")
+    # Repeated FAQ-style queries are answered from the response cache
+    answer = _cached_answer(user_query, get_content().version, memory)
+    return details, answer, "cache" if answer is not None else "llm"
+
+def _fast_answer(user_query, memory, name, phone, start):
+    """Run the cheap tiers; returns (details, answer), answer None if the turn needs the LLM"""
+    with metrics.stage("fast_tiers"):
+        details, answer, tier = _answer_without_llm(user_query, memory, name, phone)
+    if answer is not None:
+        router.record(tier, time.perf_counter() - start)
+    return details, answer
+
+def _prepare_prompt(user_query, bulk_content, memory, name, phone, details):
+    """
+    Build the prompt for a turn the cheap tiers couldn't answer
     
-    # Make the API call
-    ai_response = llm.invoke(prompt).content
+    Returns:
+        tuple: (prompt, content_version, log_payloads)
+    """
+    content_version = get_content().version
+    # A locally found number is reliable; a locally guessed name is only a fallback for
+    # the LLM's, so the model is still asked to extract the name.
+    # Name and phone extraction is skipped once both are known.
+    phone = details['phone'] or phone
+    with metrics.stage("prompt"):
+        prompt = build_prompt(user_query, bulk_content, TEMPLATE_CHOICES, memory, name, phone,
+                              extract_details=not (name and phone))
     
-    # Log response for debugging
-    logging.debug(f"Raw LLM response: {ai_response}")
+    # Log a sample of prompts and raw responses for debugging
+    log_payloads = log_setup.payload_sampled()
+    if log_payloads:
+        logging.debug("Prompt sent to LLM: %s", prompt)
+    return prompt, content_version, log_payloads
+
+def _parse_output(prompt, ai_response, log_payloads):
+    metrics.observe_tokens(estimate_tokens(prompt), estimate_tokens(ai_response))
+    if log_payloads:
+        logging.debug("Raw LLM response: %s", ai_response)
+    with metrics.stage("parse"):
+        return parse_llm_output(ai_response)
+
+def _finish_turn(user_query, prompt, content_version, parsed, details, name, start):
+    """Log, cache and record an LLM turn; returns (name, phone, summary, response)"""
+    logging.info("Processed response - Name: %s, Phone: %s, Template: %s, Summary %s, Response length: %d",
+                 parsed['name'], parsed['phone'], parsed['template'], parsed['summary'], len(parsed['response']))
+    _cache_answer(user_query, content_version, name or details['name'], parsed)
+    router.record("llm", time.perf_counter() - start, estimate_tokens(prompt))
+    return _merge_name(parsed, details, name), parsed['phone'] or details['phone'], cap_summary(parsed['summary']), parsed['response']
+
+async def process_user_query(user_query, bulk_content, memory=None, name=None, phone=None):
+    """
+    Process user query and generate all needed data in a single API call
     
-    # Extract all components
-    name_match = re.search(r'Name: (.+)', ai_response)
-    name_str = name_match.group(1).strip() if name_match else "Unknown"
-    name = name_str if name_str != "Unknown" else None
+    Args:
+        user_query (str): The user's query
+        bulk_content (dict): Dictionary of all content with ID as key
+        memory (ConversationMemory, optional): Rolling summary and recent turns of the session
+        name (str, optional): User's name if known
+        phone (str, optional): User's phone if known
     
-    phone_match = re.search(r'Phone: (.+)', ai_response)
-    phone_str = phone_match.group(1).strip() if phone_match else "Unknown"
-    phone = phone_str if phone_str != "Unknown" else None
+    Returns:
+        tuple: (name, phone, summary, response)
+    """
+    start = time.perf_counter()
+    details, answer = _fast_answer(user_query, memory, name, phone, start)
+    if answer is not None:
+        return answer
     
-    template_match = re.search(r'Template: (.+)', ai_response)
-    template_str = template_match.group(1).strip() if template_match else "General"
+    prompt, content_version, log_payloads = _prepare_prompt(user_query, bulk_content, memory, name, phone, details)
+    with metrics.stage("llm"):
+        ai_response = await invoke_llm(prompt)
+    parsed = _parse_output(prompt, ai_response, log_payloads)
+    return _finish_turn(user_query, prompt, content_version, parsed, details, name, start)
+
+async def stream_user_query(user_query, bulk_content, memory=None, name=None, phone=None):
+    """
+    Streaming variant of process_user_query
     
-    summary_match = re.search(r'Summary: (.+?)(?=Response:|$)', ai_response, re.DOTALL)
-    summary = summary_match.group(1).strip() if summary_match else ""
+    The short JSON fields are buffered; the "response" string is decoded and forwarded
+    as it is generated (see llm_output.ResponseFieldStream).
     
-    response_match = re.search(r'Response: (.+)', ai_response, re.DOTALL)
-    response = response_match.group(1).strip() if response_match else "I'm here to help you with information about RK Nature Cure Home. How can I assist you today?"
+    Yields:
+        tuple: ("token", str) for each piece of the response text, then
+            ("done", (name, phone, summary, response)) once the output is complete
+    """
+    start = time.perf_counter()
+    details, answer = _fast_answer(user_query, memory, name, phone, start)
+    if answer is not None:
+        yield "token", answer[3]
+        yield "done", answer
+        return
     
-    logging.info(f"Processed response - Name: {name}, Phone: {phone}, Template: {template_str}, Summary {summary}, Response length: {len(response)}")
+    prompt, content_version, log_payloads = _prepare_prompt(user_query, bulk_content, memory, name, phone, details)
+    ai_response = ""
+    reply = ResponseFieldStream()
+    streamed = ""
+    llm_start = time.perf_counter()
+    async for chunk in stream_llm(prompt):
+        if not ai_response:
+            metrics.observe_stage("llm_first_chunk", time.perf_counter() - llm_start)
+        ai_response += chunk
+        text = reply.feed(chunk)
+        if text:
+            streamed += text
+            yield "token", text
+    metrics.observe_stage("llm", time.perf_counter() - llm_start)
     
-    return name, phone, summary, response
\ No newline at end of file
+    parsed = _parse_output(prompt, ai_response, log_payloads)
+    if parsed['response'].startswith(streamed) and len(parsed['response']) > len(streamed):
+        # Nothing streamed (repaired or fallback output), or the tail of a repaired reply
+        yield "token", parsed['response'][len(streamed):]
+    yield "done", _finish_turn(user_query, prompt, content_version, parsed, details, name, start)
+
+def _merge_name(parsed, details, known_name):
+    """The LLM's name; the local guess only if neither the LLM nor the session has one"""
+    if parsed['name'] or known_name:
+        return parsed['name']
+    return details['name']
+
+def _extend_summary(memory, user_query):
+    """Summary for a cached answer: the previous summary plus the new question"""
+    return roll_summary(memory, f"The user also asked: {user_query}")
@@ -0,0 +1,90 @@
+"""
+Logging that stays off the request path.
+
+configure_logging() gives the root logger a single QueueHandler. A QueueListener thread
+formats the queued records and writes them to LOG_FILE (rotated by size, or by time with
+LOG_ROTATE_WHEN) and to stderr, so a log call only appends a record to a queue. Records are
+queued unformatted, so pass arguments lazily (logging.info("... %s", value)) rather than
+building f-strings. When the queue is full, records are dropped and counted instead of
+blocking the request.
+
+Prompts, raw LLM output and full replies run to several KB. Callers log them at DEBUG only
+when payload_sampled() picks the call (LOG_PAYLOAD_SAMPLE_RATE).
+"""
+import sys
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from config import (
+    LOG_LEVEL, LOG_FILE, LOG_MAX_BYTES, LOG_ROTATE_WHEN, LOG_BACKUP_COUNT, LOG_QUEUE_SIZE,
+    LOG_PAYLOAD_SAMPLE_RATE
+)
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+dropped = 0  # records discarded because the queue was full
+_listener = None
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # The listener runs in this process, so the record is handed over as is; the
+        # message (and any traceback) is formatted on the writer thread
+        return record
+
+    def enqueue(self, record):
+        global dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped += 1
+
+class _QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Wait for room, so stopping a listener behind a full queue still writes out the backlog
+        self.queue.put(self._sentinel)
+
+def _file_handler():
+    if LOG_ROTATE_WHEN:
+        return logging.handlers.TimedRotatingFileHandler(
+            LOG_FILE, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+        )
+    return logging.handlers.RotatingFileHandler(
+        LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+    )
+
+def configure_logging():
+    """Route the root logger through the queue and start the writer thread (idempotent)"""
+    global _listener
+    if _listener is not None:
+        return
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [_file_handler(), logging.StreamHandler(sys.stderr)]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL.upper())
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(NonBlockingQueueHandler(log_queue))
+
+    _listener = _QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+def stop_logging():
+    """Write out the queued records and stop the writer thread"""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
+
+def payload_sampled():
+    """Whether to log this call's prompt/response payload (DEBUG enabled and sampled)"""
+    return logging.getLogger().isEnabledFor(logging.DEBUG) and random.random() < LOG_PAYLOAD_SAMPLE_RATE
@@ -1,75 +1,212 @@
+import json
 import asyncio
 import logging
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-from config import DEBUG, HOST, PORT
+from contextlib import aclosing
+from quart import Quart, Response, request, jsonify
+from quart_cors import cors
+from config import DEBUG, HOST, PORT, TRUSTED_PROXY_HOPS
 from database import (
-    log_chat, update_summary, get_chat_data, 
-    fetch_keywords_data, get_user_info, update_user_info
-)
-from llm_service import process_user_query
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("app.log"),
-        logging.StreamHandler()
-    ]
+    load_session_state, get_content_index, get_content, watch_content,
+    init_pool, close_pool, check_pool_health
 )
+from migrations import MigrationError
+import write_behind
+import conversation_memory
+import metrics
+import admission
+import log_setup
+from llm_service import process_user_query, stream_user_query
+from retrieval import retrieve_content
 
-app = Flask(__name__)
-CORS(app)
+# Configure logging (records are written by a background thread)
+log_setup.configure_logging()
 
-@app.route('/submit_query', methods=['POST'])
-def submit_query():
-    data = request.get_json()
-    user_query = data.get('Query')
-    session_id = data.get('SessionId')
-    
-    if not user_query:
+# ASGI app: serve with e.g. `hypercorn main:app --bind 0.0.0.0:8000`
+app = Quart(__name__)
+app = cors(app, allow_origin="*")
+
+@app.before_serving
+async def startup():
+    try:
+        await init_pool()
+    except MigrationError:
+        # Serving on a half-migrated schema would fail on every write
+        raise
+    except Exception as e:
+        # acquire() retries pool creation lazily on the first request
+        logging.error(f"Could not create database pool at startup: {e}")
+    await check_pool_health()
+    write_behind.start()
+    # Load content before the first request, then hot-reload it when the file changes
+    await asyncio.to_thread(get_content)
+    app.content_watcher = asyncio.create_task(watch_content())
+
+@app.after_serving
+async def shutdown():
+    app.content_watcher.cancel()
+    await write_behind.stop()
+    await close_pool()
+    log_setup.stop_logging()
+
+def validate_query(data):
+    """Return an error response for a malformed request body, or None"""
+    if not data or not data.get('Query'):
         return jsonify({"error": "Missing Query!"}), 400
-    if not session_id:
+    if not data.get('SessionId'):
         return jsonify({"error": "Missing SessionId!"}), 400
+    return None
+
+def client_ip():
+    """
+    The address the outermost trusted proxy saw the request come from
     
-    return asyncio.run(handle_query(session_id, user_query))
+    Each trusted proxy appends its peer to X-Forwarded-For, so the client is the
+    TRUSTED_PROXY_HOPS-th entry from the right; entries further left are set by the
+    client and can't be trusted.
+    """
+    forwarded = [entry.strip() for entry in request.headers.get("X-Forwarded-For", "").split(",") if entry.strip()]
+    if TRUSTED_PROXY_HOPS and forwarded:
+        return forwarded[-min(TRUSTED_PROXY_HOPS, len(forwarded))]
+    return request.remote_addr
 
-async def handle_query(session_id, user_query):
-    # Get existing user data
-    existing_info = await get_user_info(session_id)
-    existing_name = existing_info.get('name')
-    existing_phone = existing_info.get('phone')
+def degraded_payload(session_id, user_query):
+    return {
+        "response": admission.degraded_reply(user_query),
+        "SessionId": session_id,
+        "name": None,
+        "phone": None,
+        "degraded": True
+    }
+
+def shed_response(shed, session_id, user_query):
+    """429 for rate-limited clients, 503 when the worker is saturated; both carry a usable reply"""
+    status = 429 if shed.reason.endswith("_rate") else 503
+    response = jsonify(degraded_payload(session_id, user_query))
+    response.status_code = status
+    response.headers["Retry-After"] = str(max(1, round(shed.retry_after)))
+    return response
+
+@app.route('/submit_query', methods=['POST'])
+async def submit_query():
+    data = await request.get_json()
+    error = validate_query(data)
+    if error:
+        return error
     
-    # Get content data
-    data_dict = fetch_keywords_data()
-    bulk_content = {id: info['content'] for id, info in data_dict.items()}
+    trace = metrics.start_trace(request.headers.get("X-Request-ID"))
+    try:
+        async with admission.admit(data['SessionId'], client_ip()):
+            response = jsonify(await handle_query(data['SessionId'], data['Query']))
+    except admission.Shed as shed:
+        response = shed_response(shed, data['SessionId'], data['Query'])
+    finally:
+        metrics.finish_trace(trace, "submit_query")
+    if trace is not None:
+        response.headers["X-Trace-ID"] = trace.trace_id
+    return response
+
+@app.route('/submit_query/stream', methods=['POST'])
+async def submit_query_stream():
+    """
+    Same contract as /submit_query, streamed as server-sent events:
+    "token" events ({"text": ...}) as the reply is generated, then one "done"
+    event with the full JSON payload of /submit_query.
+    """
+    data = await request.get_json()
+    error = validate_query(data)
+    if error:
+        return error
+    session_id, user_query = data['SessionId'], data['Query']
+    trace_id = request.headers.get("X-Request-ID") or metrics.new_trace_id()
+    # Rate limits are checked before the stream starts, so they can still answer 429
+    try:
+        admission.check_rate_limits(session_id, client_ip())
+    except admission.Shed as shed:
+        return shed_response(shed, session_id, user_query)
     
-    # Get existing chat summary
-    existing_summary = await get_chat_data(session_id)
+    async def events():
+        trace = metrics.start_trace(trace_id)
+        try:
+            async with admission.slot(), aclosing(reply_events(session_id, user_query)) as reply:
+                async for event in reply:
+                    yield event
+        except admission.Shed:
+            # Saturated: answer with the canned reply instead of waiting any longer
+            payload = degraded_payload(session_id, user_query)
+            yield server_sent_event("token", {"text": payload["response"]})
+            yield server_sent_event("done", payload)
+        finally:
+            metrics.finish_trace(trace, "submit_query_stream")
     
-    # Process query with LLM
-    new_name, new_phone, summary, response = await process_user_query(
-        user_query, 
-        bulk_content, 
-        existing_summary,
-        existing_name,
-        existing_phone
-    )
+    return Response(events(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+        "X-Trace-ID": trace_id
+    })
 
-    # Update user info
-    name = new_name if new_name is not None else existing_name
-    phone = new_phone if new_phone is not None else existing_phone
-    logging.info(f"Name: {name}, Phone number: {phone}")
+async def reply_events(session_id, user_query):
+    """Server-sent events for one streamed turn"""
+    turn = None
+    try:
+        state, bulk_content, memory = await load_turn_context(session_id, user_query)
+        async for kind, payload in stream_user_query(
+            user_query, bulk_content, memory, state['name'], state['phone']
+        ):
+            if kind == "token":
+                yield server_sent_event("token", {"text": payload})
+            else:
+                new_name, new_phone, summary, response = payload
+                response_data = build_reply(session_id, state, new_name, new_phone, response)
+                turn = (response_data['name'], response_data['phone'], summary, user_query, response, state)
+        
+        # The request for missing details is appended after the model's text
+        suffix = response_data['response'][len(response):]
+        if suffix:
+            yield server_sent_event("token", {"text": suffix})
+        yield server_sent_event("done", response_data)
+    except Exception as e:
+        logging.error(f"Streaming query failed for session {session_id}: {e}")
+        yield server_sent_event("error", {"error": "Could not get response"})
+    finally:
+        # Persist once the model's reply is complete, even if the client went away while the
+        # last events were being sent. A reply cut off mid-stream has no summary and isn't saved.
+        if turn is not None:
+            with metrics.stage("persist"):
+                await write_behind.enqueue_turn(session_id, *turn)
+
+@app.route('/metrics')
+async def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+def server_sent_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def load_turn_context(session_id, user_query):
+    """
+    Load what the LLM needs for a turn
     
-    # Update database
-    new_user_info = {'name': name, 'phone': phone}
-    await update_user_info(session_id, new_user_info)
-    await update_summary(session_id, summary)
+    Returns:
+        tuple: (state, bulk_content, memory)
+    """
+    # Get existing user data and chat history in one round-trip (or from unflushed writes)
+    with metrics.stage("load_state"):
+        state = write_behind.get_pending_state(session_id) or await load_session_state(session_id)
     
-    # Log conversation
-    new_log_entry = f"User: {user_query} | Bot: {response}"
-    await log_chat(session_id, new_log_entry)
+    # Get the content relevant to this query and the recent turns
+    memory = conversation_memory.from_state(state)
+    with metrics.stage("retrieval"):
+        bulk_content = retrieve_content(get_content_index(), user_query,
+                                        context=conversation_memory.search_context(memory))
+    
+    return state, bulk_content, memory
+
+def build_reply(session_id, state, new_name, new_phone, response):
+    """Merge the extracted user details into the session and build the JSON reply"""
+    # Update user info
+    name = new_name if new_name is not None else state['name']
+    phone = new_phone if new_phone is not None else state['phone']
+    logging.info("Name: %s, Phone number: %s", name, phone)
     
     # Create final response
     final_answer = response
@@ -87,8 +224,30 @@ async def handle_query(session_id, user_query):
         "name": name,
         "phone": phone
     }
-    logging.info(f"Response to the user: {response_data}")
-    return jsonify(response_data)
+    logging.info("Reply for session %s - Response length: %d", session_id, len(final_answer))
+    if log_setup.payload_sampled():
+        logging.debug("Response to the user: %s", response_data)
+    return response_data
+
+async def handle_query(session_id, user_query):
+    state, bulk_content, memory = await load_turn_context(session_id, user_query)
+    
+    # Process query with LLM
+    new_name, new_phone, summary, response = await process_user_query(
+        user_query, 
+        bulk_content, 
+        memory,
+        state['name'],
+        state['phone']
+    )
+    response_data = build_reply(session_id, state, new_name, new_phone, response)
+    
+    # Queue user info, summary and the new turn for a batched background write
+    with metrics.stage("persist"):
+        await write_behind.enqueue_turn(
+            session_id, response_data['name'], response_data['phone'], summary, user_query, response, state
+        )
+    return response_data
 
 if __name__ == '__main__':
     app.run(debug=DEBUG, host=HOST, port=PORT)
\ No newline at end of file
@@ -0,0 +1,161 @@
+"""
+In-process metrics for the chat pipeline, served in Prometheus text format at /metrics.
+
+Pipeline code wraps each stage in `with metrics.stage("llm"):`. Stage timings go into the
+chat_stage_seconds histogram, and into the current request's trace when one is active.
+A trace (start_trace/finish_trace) also collects the request's database round-trips. With
+METRICS_TRACE_LOG set, each finished request logs its per-stage breakdown under its trace ID.
+
+Routing, fast-path, response-cache and pool counters are read from their modules at scrape
+time, so no turn pays for them twice. Token counts use retrieval.estimate_tokens.
+"""
+import time
+import uuid
+import logging
+import contextvars
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from config import METRICS_ENABLED, METRICS_TRACE_LOG
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+ROUND_TRIP_BUCKETS = (0, 1, 2, 3, 5, 10)
+
+class Histogram:
+    """Prometheus-style histogram with one optional label"""
+
+    def __init__(self, name, description, buckets, label=None):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.label = label
+        self.series = defaultdict(lambda: [[0] * (len(buckets) + 1), 0.0, 0])  # bucket counts, sum, count
+
+    def observe(self, value, label_value=""):
+        series = self.series[label_value]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for label_value, (counts, total, count) in sorted(self.series.items()):
+            labels = f'{self.label}="{label_value}",' if self.label else ""
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+            suffix = f"{{{labels.rstrip(',')}}}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {count}")
+        return lines
+
+stage_seconds = Histogram("chat_stage_seconds", "Time spent in each pipeline stage", LATENCY_BUCKETS, "stage")
+request_seconds = Histogram("chat_request_seconds", "End-to-end request time", LATENCY_BUCKETS, "endpoint")
+llm_tokens = Histogram("chat_llm_tokens", "Estimated LLM tokens per call", TOKEN_BUCKETS, "kind")
+request_round_trips = Histogram("chat_db_round_trips", "Database round-trips per request", ROUND_TRIP_BUCKETS)
+
+class Trace:
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+        self.start = time.perf_counter()
+        self.stages = defaultdict(float)
+        self.round_trips = 0
+
+_current_trace = contextvars.ContextVar("chat_trace", default=None)
+
+def new_trace_id():
+    return uuid.uuid4().hex[:16]
+
+def start_trace(trace_id=None):
+    """Begin tracing the current request; returns the Trace (None if metrics are off)"""
+    if not METRICS_ENABLED:
+        return None
+    trace = Trace(trace_id or new_trace_id())
+    _current_trace.set(trace)
+    return trace
+
+def finish_trace(trace, endpoint):
+    if trace is None:
+        return
+    elapsed = time.perf_counter() - trace.start
+    request_seconds.observe(elapsed, endpoint)
+    request_round_trips.observe(trace.round_trips)
+    if METRICS_TRACE_LOG:
+        breakdown = " ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in trace.stages.items())
+        logging.info("trace=%s %s total=%.1fms db_round_trips=%d %s",
+                     trace.trace_id, endpoint, elapsed * 1000, trace.round_trips, breakdown)
+
+@contextmanager
+def stage(name):
+    """Time a pipeline stage"""
+    if not METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - start)
+
+def observe_stage(name, seconds):
+    """Record a stage timed by the caller (e.g. across the yields of a stream)"""
+    if not METRICS_ENABLED:
+        return
+    stage_seconds.observe(seconds, name)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.stages[name] += seconds
+
+def observe_tokens(prompt_tokens, completion_tokens):
+    if METRICS_ENABLED:
+        llm_tokens.observe(prompt_tokens, "prompt")
+        llm_tokens.observe(completion_tokens, "completion")
+
+def count_round_trip():
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.round_trips += 1
+
+def _counter(name, description, values, label=None, metric_type="counter"):
+    lines = [f"# HELP {name} {description}", f"# TYPE {name} {metric_type}"]
+    for label_value, value in values:
+        lines.append(f'{name}{{{label}="{label_value}"}} {value}' if label else f"{name} {value}")
+    return lines
+
+def render():
+    """All metrics in Prometheus text exposition format"""
+    import admission
+    import database
+    import fast_path
+    import llm_output
+    import log_setup
+    import router
+    from response_cache import response_cache
+
+    lines = []
+    for histogram in (request_seconds, stage_seconds, llm_tokens, request_round_trips):
+        lines += histogram.render()
+    lines += _counter("chat_turns_total", "Turns by the tier that answered them",
+                      [(tier, router.stats["tiers"][tier]) for tier in router.TIERS], "tier")
+    lines += _counter("chat_template_answers_total", "Turns answered from deterministic templates",
+                      sorted(router.stats["templates"].items()), "template")
+    lines += _counter("chat_fast_path_total", "Fast-path classifier outcomes",
+                      [(key, value) for key, value in fast_path.stats.items()], "outcome")
+    lines += _counter("chat_llm_output_total", "LLM outputs by parse result",
+                      [(key, value) for key, value in llm_output.stats.items()], "result")
+    if response_cache is not None:
+        cache_stats = response_cache.stats()
+        lines += _counter("chat_response_cache_lookups_total", "Response cache lookups",
+                          [("hit", cache_stats["hits"]), ("miss", cache_stats["misses"])], "result")
+        lines += _counter("chat_response_cache_entries", "Entries in the response cache",
+                          [(None, cache_stats["size"])], metric_type="gauge")
+    lines += _counter("chat_shed_total", "Requests refused by admission control",
+                      [(reason, admission.stats[reason]) for reason in admission.SHED_REASONS], "reason")
+    lines += _counter("chat_admission_requests", "Requests holding or waiting for a query slot",
+                      [("active", admission.active), ("waiting", admission.waiting)], "state", metric_type="gauge")
+    lines += _counter("chat_log_records_dropped_total", "Log records dropped because the log queue was full",
+                      [(None, log_setup.dropped)])
+    lines += _counter("chat_db_round_trips_total", "Queries sent by pooled connections", [(None, database.round_trips)])
+    return "\n".join(lines) + "\n"
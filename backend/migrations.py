@@ -0,0 +1,166 @@
+"""
+Neon schema migrations.
+
+Applied at startup by database.init_pool (unless RUN_MIGRATIONS_ON_STARTUP=0), or manually:
+    python migrations.py
+"""
+import asyncio
+import logging
+import asyncpg
+
+# Unique indexes of chat_logs on session_id alone, other than chat_logs_session_id_key
+SESSION_ID_UNIQUE_SQL = """
+    SELECT 1 FROM pg_index i
+    JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+    WHERE i.indrelid = 'chat_logs'::regclass AND i.indisunique AND i.indnatts = 1
+      AND a.attname = 'session_id' AND i.indexrelid IS DISTINCT FROM to_regclass('chat_logs_session_id_key')
+"""
+
+# (version, description, statements); append new migrations, never edit applied ones
+MIGRATIONS = [
+    (1, "chat_logs and user_info tables", [
+        """
+        CREATE TABLE IF NOT EXISTS chat_logs (
+            session_id TEXT PRIMARY KEY,
+            log TEXT,
+            summary TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_info (
+            session_id TEXT PRIMARY KEY,
+            keyword_id INTEGER,
+            name TEXT,
+            phone TEXT,
+            template TEXT
+        )
+        """,
+    ]),
+    (2, "append-only chat_messages", [
+        """
+        CREATE TABLE IF NOT EXISTS chat_messages (
+            session_id TEXT NOT NULL,
+            turn_index INTEGER NOT NULL,
+            user_message TEXT NOT NULL,
+            bot_message TEXT NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (session_id, turn_index)
+        )
+        """,
+        # ON CONFLICT (session_id) needs a unique index; chat_logs may predate its primary key,
+        # and the original unlocked read-then-INSERT in log_chat could leave duplicate rows. They
+        # are merged into the newest row (logs concatenated, its summary kept) first.
+        # (Edited after release: only databases where this migration failed still run it.)
+        """
+        UPDATE chat_logs c SET log = m.log
+        FROM (
+            SELECT (array_agg(ctid ORDER BY ctid DESC))[1] AS keep,
+                   string_agg(NULLIF(log, ''), ' | ' ORDER BY ctid) AS log
+            FROM chat_logs GROUP BY session_id HAVING count(*) > 1
+        ) m
+        WHERE c.ctid = m.keep
+        """,
+        "DELETE FROM chat_logs a USING chat_logs b WHERE a.session_id = b.session_id AND a.ctid < b.ctid",
+        # A primary key or unique constraint on session_id already serves ON CONFLICT
+        f"""
+        DO $$
+        BEGIN
+            IF NOT EXISTS ({SESSION_ID_UNIQUE_SQL}) THEN
+                CREATE UNIQUE INDEX chat_logs_session_id_key ON chat_logs (session_id);
+            END IF;
+        END $$
+        """,
+        "ALTER TABLE chat_logs ADD COLUMN IF NOT EXISTS turn_count INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE chat_logs ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now()",
+    ]),
+    (3, "index chat_logs by last update", [
+        "CREATE INDEX IF NOT EXISTS chat_logs_updated_at_idx ON chat_logs (updated_at, session_id)",
+    ]),
+    (4, "drop the redundant chat_logs session_id index", [
+        # Migration 2 used to add it next to an existing primary key
+        f"""
+        DO $$
+        BEGIN
+            IF EXISTS ({SESSION_ID_UNIQUE_SQL}) THEN
+                DROP INDEX IF EXISTS chat_logs_session_id_key;
+            END IF;
+        END $$
+        """,
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+class MigrationError(Exception):
+    """A migration statement failed; the schema stays at the previous version"""
+
+# Arbitrary key so concurrent workers don't migrate at the same time
+MIGRATION_LOCK_ID = 74201
+
+async def get_schema_version(conn):
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """)
+    return await conn.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+
+async def _locked_schema_version(conn):
+    # Transaction-level lock: Neon's -pooler endpoint is PgBouncer in transaction mode, so a
+    # session-level unlock could run on a different backend and leak the lock
+    await conn.execute("SELECT pg_advisory_xact_lock($1)", MIGRATION_LOCK_ID)
+    return await get_schema_version(conn)
+
+async def migrate(conn):
+    """
+    Apply pending migrations, each in its own transaction
+    
+    Each transaction holds the migration lock and re-reads the schema version, so
+    concurrent workers never apply a migration twice.
+    
+    Args:
+        conn: An asyncpg connection
+    
+    Returns:
+        int: The schema version after migrating
+    
+    Raises:
+        MigrationError: A migration's statements were rejected
+    """
+    async with conn.transaction():
+        current = await _locked_schema_version(conn)
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        try:
+            async with conn.transaction():
+                current = await _locked_schema_version(conn)
+                if version <= current:
+                    continue
+                for statement in statements:
+                    await conn.execute(statement)
+                await conn.execute(
+                    "INSERT INTO schema_version (version, description) VALUES ($1, $2)",
+                    version, description
+                )
+        except asyncpg.PostgresError as e:
+            raise MigrationError(f"Schema migration {version} ({description}) failed: {e}") from e
+        logging.info(f"Applied schema migration {version}: {description}")
+        current = version
+    return current
+
+async def main():
+    from database import connect_to_neon
+
+    conn = await connect_to_neon()
+    try:
+        version = await migrate(conn)
+        print(f"Schema is at version {version}")
+    finally:
+        await conn.close()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
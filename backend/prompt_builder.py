@@ -1,59 +1,104 @@
 import logging
+from functools import lru_cache
+from conversation_memory import render
 
-def build_prompt(user_query, bulk_content, template_choices, chat_summary=None, name=None, phone=None):
+TEMPLATE_CHOICES = (
+    "Hello", "Introduction", "AboutUs", "HealthIssueGeneral",
+    "BackPain", "JointPain", "Stress", "Diabetes", "Location", 
+    "OurContactDetails", "Directions", "TherapyOptions", "OnlineServices", 
+    "Accommodation", "Appointment", "BookingProcess", "FirstVisitInfo", 
+    "Pricing", "Insurance", "Packages", "TreatmentDuration", "ShortStay",
+    "Follow-up", "HomeRemedies", "YogaPrograms", "Diet", "DietaryGuidance", 
+    "DetoxPrograms", "SafetyProtocols", "Covid", "Hours", "Doctors", 
+    "Consultation", "FirstVisit", "Wellness", "Treatment", "Emergency", 
+    "Testimonials", "General", "Unknown"
+)
+
+def build_prompt(user_query, bulk_content, template_choices=TEMPLATE_CHOICES, memory=None, name=None, phone=None, extract_details=True):
     """
     Build the prompt for the LLM
     
+    The instructions, template list and guidance form a static prefix that is built once
+    (see get_static_prefix), so provider-side prompt caching can reuse it. Only the content,
+    conversation memory, known user details and query are spliced in per request.
+    
     Args:
         user_query (str): The user's query
-        bulk_content (dict): Dictionary of all content with ID as key
+        bulk_content (dict): Dictionary of relevant content with ID as key
         template_choices (list): List of available templates
-        chat_summary (str, optional): Summary of the chat conversation so far
+        memory (ConversationMemory, optional): Rolling summary and recent turns of the session
         name (str, optional): User's name if known
         phone (str, optional): User's phone if known
+        extract_details (bool): Ask the LLM to extract name and phone (Tasks 1 and 2);
+            skipped once both are known
     
     Returns:
         str: The complete prompt for the LLM
     """
     # Log inputs for debugging
-    logging.debug(f"Building prompt for query: {user_query}")
-    logging.debug(f"With existing name: {name}, phone: {phone}")
+    logging.debug("Building prompt for query: %s", user_query)
+    logging.debug("With existing name: %s, phone: %s", name, phone)
     
-    # Include chat summary in context if available
+    # Include the (token-budgeted) conversation so far, if any
     context = ""
-    if chat_summary:
-        context = f"Chat history summary: {chat_summary}\n\n"
+    history = render(memory)
+    if history:
+        context = f"Conversation so far:\n{history}\n\n"
+    
+    return (
+        f"{get_static_prefix(tuple(template_choices), extract_details)}"
+        f"AVAILABLE CONTENT:\n{format_content_section(bulk_content)}\n\n"
+        f"{context}"
+        f"Known name: {name or 'Unknown'}\n"
+        f"Known phone: {phone or 'Unknown'}\n\n"
+        f"User query: '{user_query}'"
+    )
+
+def format_content_section(bulk_content):
+    return "\n".join([f"Content ID {id}:\n{content}" for id, content in bulk_content.items()])
+
+@lru_cache(maxsize=8)
+def get_static_prefix(template_choices=TEMPLATE_CHOICES, extract_details=True):
+    """
+    Build the request-independent part of the prompt (instructions, templates, guidance)
+    
+    Args:
+        template_choices (tuple): Available templates (a tuple, so the result can be cached)
+        extract_details (bool): Include the name and phone extraction tasks
     
+    Returns:
+        str: The prompt prefix, ending with a blank line
+    """
     # Basic assistant prompt
     base_prompt = (
-        f"You are a friendly receptionist at R K Nature Cure Home, a naturopathy hospital. "
-        f"We are asking user to provide name and number through other function, incase they reply with name or number, just say thank you and ask how can we help you. "
-        f"Answer the user's question in a warm, concise tone (max 2 lines total, including greeting). "
-        f"Keep it extremely concise and avoid technical terms. If the info isn't enough, briefly suggest contacting us. User query: '{user_query}'"
-        f" Proactively list the therapies offered if the user query is about a specific health issue, and be sympathetic & conscious of the other person's pain. "
+        "You are a friendly receptionist at R K Nature Cure Home, a naturopathy hospital. "
+        "We are asking user to provide name and number through other function, incase they reply with name or number, just say thank you and ask how can we help you. "
+        "Answer the user's question in a warm, concise tone (max 2 lines total, including greeting). "
+        "Keep it extremely concise and avoid technical terms. If the info isn't enough, briefly suggest contacting us. "
+        " Proactively list the therapies offered if the user query is about a specific health issue, and be sympathetic & conscious of the other person's pain. "
     )
     
-    # Template-specific guidance
-    template_guidance = get_template_guidance()
-    
     # Format all template guidance for the prompt
-    template_guidance_str = "\n".join([f"- {template}: {guidance}" for template, guidance in template_guidance.items()])
+    template_guidance_str = "\n".join([f"- {template}: {guidance}" for template, guidance in get_template_guidance().items()])
     
-    # Format content for the prompt
-    content_section = "\n".join([f"Content ID {id}:\n{content}" for id, content in bulk_content.items()])
-    
-    # Combined prompt that handles all tasks
-    prompt = (
-        f"{context}"
-        f"Analyze this user query carefully: '{user_query}'\n\n"
+    # Name and phone extraction, skipped once both are known
+    detail_tasks = ""
+    detail_format = ""
+    if extract_details:
+        detail_tasks = (
+            "Task 1: If a known name is given, the user's name is already known. If the user asks about their name, tell them their known name. Only look for a new name in the query if it appears to be different from the existing known name.\n\n"
+            "Return the name as a single word or phrase (e.g., 'John') or an empty string if no name is found. If the user asks his name, tell it to him if you have the information.\n\n"
         
-        f"AVAILABLE CONTENT:\n{content_section}\n\n"
-        
-        f"Task 1: The user's name is already known to be '{name}' if not None. If the user asks about their name, tell them their name is '{name}'. Only look for a new name in the query if it appears to be different from the existing known name.\n\n"
-        f"Return the name as a single word or phrase (e.g., 'John') or 'Unknown' if no name is found. The name might be {name}. If the user asks his name, tell it to him if you have the information.\n\n"
+            "Task 2: Extract the user's phone number from this query if provided. "
+            "Return just the digits of the phone number or an empty string if no phone number is found. The number might be the known phone.\n\n"
+        )
+        detail_format = '"name": "<name or empty>", "phone": "<digits or empty>", '
+    
+    # Combined instructions that handle all tasks; the user query and details follow the available content
+    return (
+        f"Analyze the user query given at the end carefully, using the AVAILABLE CONTENT.\n\n"
         
-        f"Task 2: Extract the user's phone number from this query if provided. "
-        f"Return just the digits of the phone number or 'Unknown' if no phone number is found. The number might be {phone}\n\n"
+        f"{detail_tasks}"
         
         f"Task 3: Choose the most suitable template out of the following options: {', '.join(template_choices)}. "
         f"If no template is appropriate, use 'Unknown'. Just follow the template's specific instructions & write the name of the template here ( write Unknown if no template exists)\n\n"
@@ -63,15 +108,9 @@ def build_prompt(user_query, bulk_content, template_choices, chat_summary=None,
         f"Task 5: {base_prompt}"
         f"Use the template guidance to shape your response:\n\n{template_guidance_str}\n\n"
         
-        f"Format your response exactly like this:\n"
-        f"Name: [Name or Unknown]\n"
-        f"Phone: [Phone or Unknown]\n"
-        f"Template: [Template or General]\n"
-        f"Summary: [Summary]\n"
-        f"Response: [Your actual response to the user]"
+        f"Reply with only this JSON object, no other text:\n"
+        f'{{{detail_format}"template": "<template>", "summary": "<summary>", "response": "<your reply to the user>"}}\n\n'
     )
-    
-    return prompt
 
 def get_template_guidance():
     """
@@ -80,46 +119,49 @@ def get_template_guidance():
     Returns:
         dict: Dictionary of template guidance
     """
-    return {
-        "Hello": "Provide a friendly greeting and welcome them to RK Nature Cure Home.",
-        "Introduction": "Briefly introduce RK Nature Cure Home as a premier naturopathy center in Coimbatore.",
-        "AboutUs": "Focus on our center's natural healing approach using scientifically-backed naturopathic methods.",
-        "HealthIssueGeneral": "Acknowledge their health concerns and mention all the holistic solutions offered.",
-        "BackPain": "Acknowledge their back pain and mention all the different therapies offered.",
-        "JointPain": "Acknowledge that joint pain can be debilitating and mention our mud therapy and physiotherapy.",
-        "Stress": "Emphasize our holistic approach to stress management including meditation and pranayama.",
-        "Diabetes": "Mention our natural approach to diabetes management with diet plans and exercises.",
-        "Location": "Share our address: Krishna Layout, Ganapathy, Coimbatore - 641006.",
-        "OurContactDetails": "Provide our contact number +91 88700-66622 and mention reception hours (6 AM to 8 PM).",
-        "Directions": "Offer simple directions to our facility.",
-        "TherapyOptions": "Mention we offer personalized treatments based on specific health needs.",
-        "OnlineServices": "Confirm we offer online consultations for dietary guidance and yoga sessions.",
-        "Accommodation": "Mention our comfortable stay options for extended treatment programs.",
-        "Appointment": "Offer to schedule an appointment and ask for preferred timing.",
-        "BookingProcess": "Explain our simple booking process via phone (+91 88700-66622).",
-        "FirstVisitInfo": "Advise them to bring medical reports and expect a 45-60 minute consultation.",
-        "Pricing": "Mention our customized packages and flexible payment options.",
-        "Insurance": "Explain we provide documentation for insurance reimbursement claims.",
-        "Packages": "Briefly mention our 7-day and 14-day residential programs.",
-        "TreatmentDuration": "Explain treatment duration varies based on condition (typically 7-14 days minimum).",
-        "ShortStay": "Mention our weekend wellness retreats for short rejuvenation.",
-        "Follow-up": "Emphasize the importance of follow-up care for lasting results.",
-        "HomeRemedies": "Suggest some simple home practices that complement in-center treatments.",
-        "YogaPrograms": "Highlight our therapeutic yoga programs for various conditions.",
-        "Diet": "Stress the importance of nutrition in healing and our personalized meal plans.",
-        "DietaryGuidance": "Mention our approach combining ancient wisdom with modern nutritional science.",
-        "DetoxPrograms": "Describe our detox programs for eliminating toxins and system rejuvenation.",
-        "SafetyProtocols": "Reassure about our strict hygiene protocols and certified professionals.",
-        "Covid": "Explain our COVID safety measures including sanitization and distancing.",
-        "Hours": "Share our opening hours (6 AM to 8 PM) and treatment/consultation timings.",
-        "Doctors": "Mention our team of experienced naturopaths and wellness specialists.",
-        "Consultation": "Describe our comprehensive consultations and offer online/in-person options.",
-        "FirstVisit": "Explain what to expect during their first visit and assessment.",
-        "Wellness": "Mention our five pillars approach: diet, exercise, stress management, rest, and positive thinking.",
-        "Treatment": "Emphasize our natural, non-invasive treatment approach.",
-        "Emergency": "Provide emergency contact information (+91 88700-66622) and mention medical team availability.",
-        "Testimonials": "Mention patient success stories and improvements.",
-        # "General": "Provide a general helpful response and ask how else we can assist.",
-        "General": " Answer in the way you think will help the user",
-        "Unknown": "Answer in the way you think will help the user, provide our phone (+91 88700-66622) "
-    }
\ No newline at end of file
+    return TEMPLATE_GUIDANCE
+
+# Template-specific guidance
+TEMPLATE_GUIDANCE = {
+    "Hello": "Provide a friendly greeting and welcome them to RK Nature Cure Home.",
+    "Introduction": "Briefly introduce RK Nature Cure Home as a premier naturopathy center in Coimbatore.",
+    "AboutUs": "Focus on our center's natural healing approach using scientifically-backed naturopathic methods.",
+    "HealthIssueGeneral": "Acknowledge their health concerns and mention all the holistic solutions offered.",
+    "BackPain": "Acknowledge their back pain and mention all the different therapies offered.",
+    "JointPain": "Acknowledge that joint pain can be debilitating and mention our mud therapy and physiotherapy.",
+    "Stress": "Emphasize our holistic approach to stress management including meditation and pranayama.",
+    "Diabetes": "Mention our natural approach to diabetes management with diet plans and exercises.",
+    "Location": "Share our address: Krishna Layout, Ganapathy, Coimbatore - 641006.",
+    "OurContactDetails": "Provide our contact number +91 88700-66622 and mention reception hours (6 AM to 8 PM).",
+    "Directions": "Offer simple directions to our facility.",
+    "TherapyOptions": "Mention we offer personalized treatments based on specific health needs.",
+    "OnlineServices": "Confirm we offer online consultations for dietary guidance and yoga sessions.",
+    "Accommodation": "Mention our comfortable stay options for extended treatment programs.",
+    "Appointment": "Offer to schedule an appointment and ask for preferred timing.",
+    "BookingProcess": "Explain our simple booking process via phone (+91 88700-66622).",
+    "FirstVisitInfo": "Advise them to bring medical reports and expect a 45-60 minute consultation.",
+    "Pricing": "Mention our customized packages and flexible payment options.",
+    "Insurance": "Explain we provide documentation for insurance reimbursement claims.",
+    "Packages": "Briefly mention our 7-day and 14-day residential programs.",
+    "TreatmentDuration": "Explain treatment duration varies based on condition (typically 7-14 days minimum).",
+    "ShortStay": "Mention our weekend wellness retreats for short rejuvenation.",
+    "Follow-up": "Emphasize the importance of follow-up care for lasting results.",
+    "HomeRemedies": "Suggest some simple home practices that complement in-center treatments.",
+    "YogaPrograms": "Highlight our therapeutic yoga programs for various conditions.",
+    "Diet": "Stress the importance of nutrition in healing and our personalized meal plans.",
+    "DietaryGuidance": "Mention our approach combining ancient wisdom with modern nutritional science.",
+    "DetoxPrograms": "Describe our detox programs for eliminating toxins and system rejuvenation.",
+    "SafetyProtocols": "Reassure about our strict hygiene protocols and certified professionals.",
+    "Covid": "Explain our COVID safety measures including sanitization and distancing.",
+    "Hours": "Share our opening hours (6 AM to 8 PM) and treatment/consultation timings.",
+    "Doctors": "Mention our team of experienced naturopaths and wellness specialists.",
+    "Consultation": "Describe our comprehensive consultations and offer online/in-person options.",
+    "FirstVisit": "Explain what to expect during their first visit and assessment.",
+    "Wellness": "Mention our five pillars approach: diet, exercise, stress management, rest, and positive thinking.",
+    "Treatment": "Emphasize our natural, non-invasive treatment approach.",
+    "Emergency": "Provide emergency contact information (+91 88700-66622) and mention medical team availability.",
+    "Testimonials": "Mention patient success stories and improvements.",
+    # "General": "Provide a general helpful response and ask how else we can assist.",
+    "General": " Answer in the way you think will help the user",
+    "Unknown": "Answer in the way you think will help the user, provide our phone (+91 88700-66622) "
+}
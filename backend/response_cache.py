@@ -0,0 +1,125 @@
+"""
+Response cache for repeated FAQ-style queries (hours, location, contact, pricing...).
+
+Entries are keyed on the content version and the normalised query. With
+RESPONSE_CACHE_SEMANTIC=1 and sentence-transformers installed, a miss also falls back to the
+closest cached query by embedding similarity. Queries carrying personal data or referring
+back to the conversation are never served from or stored in the cache.
+"""
+import re
+import time
+import logging
+from collections import OrderedDict
+from config import (
+    RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_WORDS,
+    RESPONSE_CACHE_SEMANTIC, RESPONSE_CACHE_SEMANTIC_MODEL, RESPONSE_CACHE_SEMANTIC_THRESHOLD
+)
+
+PHONE_PATTERN = re.compile(r"\d[\d\s\-]{4,}\d")
+EMAIL_PATTERN = re.compile(r"\S+@\S+\.\S+")
+NAME_PATTERN = re.compile(r"\b(my name|i am|i'm|im|this is|call me|name is)\b", re.IGNORECASE)
+# Follow-ups only make sense in the context of the conversation
+CONTEXT_PATTERN = re.compile(
+    r"\b(it|its|that|this|these|those|they|them|he|she|his|her|my|me|above|previous|same|also|again)\b",
+    re.IGNORECASE
+)
+
+def normalize_query(query):
+    return " ".join(re.findall(r"[a-z0-9]+", query.lower()))
+
+def is_cacheable(query):
+    """False for queries with personal data or conversational context, or that are too long"""
+    if PHONE_PATTERN.search(query) or EMAIL_PATTERN.search(query) or NAME_PATTERN.search(query):
+        return False
+    if CONTEXT_PATTERN.search(query):
+        return False
+    return 0 < len(query.split()) <= RESPONSE_CACHE_MAX_WORDS
+
+def _load_encoder():
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        logging.warning("sentence-transformers is not installed; semantic response cache disabled")
+        return None
+    return SentenceTransformer(RESPONSE_CACHE_SEMANTIC_MODEL)
+
+class ResponseCache:
+    """
+    TTL + LRU cache of LLM answers
+    
+    Args:
+        max_size (int): Entries kept before the least recently used is evicted
+        ttl (float): Seconds an entry stays valid
+        semantic (bool): Also match queries by embedding similarity
+    """
+
+    def __init__(self, max_size=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL, semantic=RESPONSE_CACHE_SEMANTIC):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires_at, value, embedding)
+        self.encoder = _load_encoder() if semantic else None
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.bypasses = 0
+
+    def _key(self, query, content_version):
+        return (content_version, normalize_query(query))
+
+    def _embed(self, query):
+        return self.encoder.encode(normalize_query(query), normalize_embeddings=True)
+
+    def get(self, query, content_version):
+        """Return the cached value for the query, or None"""
+        if not is_cacheable(query):
+            self.bypasses += 1
+            return None
+
+        now = time.monotonic()
+        key = self._key(query, content_version)
+        entry = self.entries.get(key)
+        if entry and entry[0] > now:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+        if self.encoder is not None:
+            embedding = self._embed(query)
+            best_key, best_score = None, RESPONSE_CACHE_SEMANTIC_THRESHOLD
+            for other_key, (expires_at, _, other_embedding) in self.entries.items():
+                if other_key[0] != key[0] or expires_at <= now or other_embedding is None:
+                    continue
+                score = float(embedding @ other_embedding)
+                if score >= best_score:
+                    best_key, best_score = other_key, score
+            if best_key is not None:
+                self.entries.move_to_end(best_key)
+                self.hits += 1
+                self.semantic_hits += 1
+                return self.entries[best_key][1]
+
+        self.misses += 1
+        return None
+
+    def put(self, query, content_version, value):
+        if not is_cacheable(query):
+            return
+        key = self._key(query, content_version)
+        embedding = self._embed(query) if self.encoder is not None else None
+        self.entries[key] = (time.monotonic() + self.ttl, value, embedding)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "bypasses": self.bypasses,
+            "size": len(self.entries),
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+response_cache = ResponseCache() if RESPONSE_CACHE_ENABLED else None
@@ -0,0 +1,127 @@
+import math
+import re
+from collections import Counter, defaultdict
+from config import RETRIEVAL_TOP_K, RETRIEVAL_TOKEN_BUDGET, RETRIEVAL_CHUNK_CHARS
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from",
+    "have", "how", "i", "in", "is", "it", "me", "my", "of", "on", "or", "please", "the",
+    "this", "to", "we", "what", "when", "where", "which", "with", "you", "your"
+}
+
+def tokenize(text):
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+def estimate_tokens(text):
+    """Rough LLM token count (~4 characters per token)"""
+    return len(text) // 4 + 1
+
+def split_into_chunks(content, max_chars=RETRIEVAL_CHUNK_CHARS):
+    """Split content on blank lines, packing paragraphs into chunks of at most max_chars"""
+    chunks = []
+    current = ""
+    for paragraph in re.split(r"\n\s*\n", content or ""):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if current and len(current) + len(paragraph) + 2 > max_chars:
+            chunks.append(current)
+            current = paragraph
+        else:
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+class RetrievalIndex:
+    """
+    BM25 index over extracted_data chunks. Each chunk is indexed with its row's keywords.
+    
+    Args:
+        data_dict (dict): {id: {"keyword": str, "content": str}} as returned by fetch_keywords_data
+        k1 (float): BM25 term-frequency saturation
+        b (float): BM25 length normalisation
+    """
+
+    def __init__(self, data_dict, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.chunks = []  # (content_id, text)
+        self.postings = defaultdict(list)  # term -> [(chunk index, term frequency)]
+        self.lengths = []
+        self.leading = []  # index of each row's first chunk, in row order
+
+        for content_id, info in data_dict.items():
+            for position, text in enumerate(split_into_chunks(info.get("content", ""))):
+                terms = Counter(tokenize(f"{info.get('keyword') or ''} {text}"))
+                index = len(self.chunks)
+                if position == 0:
+                    self.leading.append(index)
+                self.chunks.append((content_id, text))
+                self.lengths.append(sum(terms.values()))
+                for term, frequency in terms.items():
+                    self.postings[term].append((index, frequency))
+
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0
+        total = len(self.chunks)
+        self.idf = {
+            term: math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def search(self, query, k=RETRIEVAL_TOP_K, context="", context_weight=0.5):
+        """
+        Return the k best chunks for the query
+        
+        Args:
+            context (str): Earlier messages of the conversation; their terms also match,
+                at context_weight, so follow-ups like "how long does it take?" stay on topic
+        
+        Returns:
+            list: [(content_id, chunk_text, score)] ordered by descending score
+        """
+        weights = dict.fromkeys(tokenize(context), context_weight)
+        weights.update(dict.fromkeys(tokenize(query), 1.0))
+        scores = defaultdict(float)
+        for term, weight in weights.items():
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for index, frequency in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[index] / self.average_length)
+                scores[index] += weight * idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.chunks[index][0], self.chunks[index][1], score) for index, score in best]
+
+    def overview(self, k=RETRIEVAL_TOP_K):
+        """The first chunk of the first k rows, for queries that match nothing"""
+        return [(self.chunks[index][0], self.chunks[index][1], 0.0) for index in self.leading[:k]]
+
+def retrieve_content(index, query, k=RETRIEVAL_TOP_K, token_budget=RETRIEVAL_TOKEN_BUDGET, context=""):
+    """
+    Select the top-k chunks for a query that fit in the token budget
+    
+    A query that matches nothing ("What do you do?") gets the opening chunks of the
+    content instead, so the prompt is never sent without any content.
+    
+    Args:
+        index (RetrievalIndex): The content index
+        query (str): The user's query
+        k (int): Maximum number of chunks
+        token_budget (int): Maximum estimated tokens of content to return
+        context (str): Recent messages of the session, matched at a lower weight
+    
+    Returns:
+        dict: Content ID -> relevant text, in the bulk_content shape build_prompt expects
+    """
+    selected = {}
+    used = 0
+    for content_id, text, _ in index.search(query, k, context) or index.overview(k):
+        cost = estimate_tokens(text)
+        if used + cost > token_budget:
+            continue
+        used += cost
+        selected[content_id] = f"{selected[content_id]}\n\n{text}" if content_id in selected else text
+    return selected
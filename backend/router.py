@@ -0,0 +1,120 @@
+"""
+Tiered routing of chat turns.
+
+Each turn is answered by the cheapest tier that can handle it:
+    local    - fast_path (greetings, thanks, goodbyes, name/number only)
+    template - deterministic templates (Location, Hours, OurContactDetails) filled from
+               TEMPLATE_GUIDANCE facts, when the whole message is about those topics
+    cache    - response_cache hit
+    llm      - the full Gemini prompt
+
+record() keeps per-tier counts and latency, and estimates the prompt tokens the cheaper tiers
+avoided from the average prompt size of the turns that did reach the LLM.
+"""
+import re
+import logging
+from collections import Counter, defaultdict
+from conversation_memory import roll_summary
+from fast_path import PHONE_PATTERN
+
+TIERS = ("local", "template", "cache", "llm")
+
+WORD_PATTERN = re.compile(r"[a-z']+")
+
+# Words that pick a template; a message must use at least one
+TEMPLATE_KEYWORDS = {
+    "Location": {"where", "address", "location", "located", "situated", "area", "city", "pincode", "map"},
+    "Hours": {"timings", "timing", "hours", "open", "opening", "opened", "close", "closing", "closed", "time", "working"},
+    "OurContactDetails": {"contact", "phone", "number", "mobile", "call", "whatsapp", "telephone"},
+}
+# Words that may appear around them without changing what is asked. "me" and "there" are
+# left out on purpose: "call me", "how to go there" need the LLM
+NEUTRAL_WORDS = {
+    "what", "what's", "whats", "is", "are", "your", "you", "the", "a", "an", "of", "and", "to",
+    "i", "can", "could", "do", "does", "please", "pls", "tell", "share", "give", "send", "know", "want",
+    "may", "get", "exact", "full", "center", "centre", "hospital", "clinic", "rk", "nature", "cure",
+    "home", "us", "which", "at", "for", "on", "in", "it", "kindly", "sir", "madam", "details",
+    "detail", "hi", "hello", "ok", "okay", "time's", "from", "till", "until", "when", "u", "ur", "how",
+    "sent", "provide", "need", "hey", "exactly", "s",
+}
+
+# Facts from TEMPLATE_GUIDANCE, phrased as replies
+TEMPLATE_REPLIES = {
+    "Location": "We're at Krishna Layout, Ganapathy, Coimbatore - 641006.",
+    "Hours": "We're open from 6 AM to 8 PM.",
+    "OurContactDetails": "You can call us on +91 88700-66622 (reception hours 6 AM to 8 PM).",
+}
+CLOSING = " We'd be happy to help you{name}!"
+
+stats = {
+    "turns": 0,
+    "tiers": Counter(),
+    "templates": Counter(),
+    "seconds": defaultdict(float),
+    "llm_prompt_tokens": 0,
+}
+
+def classify_template(user_query):
+    """
+    Pick the deterministic templates a message asks about
+
+    Returns:
+        list: Matching templates in TEMPLATE_REPLIES order, or [] if any part of the
+            message is open-ended or it shares a phone number (needs the LLM)
+    """
+    # "please call me on 98...": a callback request, not a question about our number
+    if PHONE_PATTERN.search(user_query):
+        return []
+    matched = set()
+    for word in WORD_PATTERN.findall(user_query.lower()):
+        templates = {template for template, keywords in TEMPLATE_KEYWORDS.items() if word in keywords}
+        if templates:
+            matched |= templates
+        elif word not in NEUTRAL_WORDS:
+            return []
+    return [template for template in TEMPLATE_REPLIES if template in matched]
+
+def answer_from_template(user_query, memory=None, name=None, phone=None):
+    """
+    Answer a turn from the deterministic templates
+
+    Returns:
+        tuple: (name, phone, summary, response) like process_user_query, or None if the
+            turn needs a model
+    """
+    templates = classify_template(user_query)
+    if not templates:
+        return None
+    stats["templates"].update(templates)
+    response = " ".join(TEMPLATE_REPLIES[template] for template in templates)
+    response += CLOSING.format(name=f", {name}" if name else "")
+    summary = roll_summary(memory, f"The user asked for our {', '.join(templates)}.")
+    logging.info("Answered from template %s without the LLM", '+'.join(templates))
+    return None, None, summary, response
+
+def record(tier, seconds, prompt_tokens=0):
+    """Count a routed turn; prompt_tokens is the prompt size for LLM turns"""
+    stats["turns"] += 1
+    stats["tiers"][tier] += 1
+    stats["seconds"][tier] += seconds
+    stats["llm_prompt_tokens"] += prompt_tokens
+
+def routing_report():
+    """
+    Routing decisions so far
+
+    Returns:
+        dict: share and mean latency per tier, template counts, and the estimated
+            prompt tokens avoided by not calling the LLM
+    """
+    llm_turns = stats["tiers"]["llm"]
+    mean_prompt = stats["llm_prompt_tokens"] / llm_turns if llm_turns else 0
+    return {
+        "turns": stats["turns"],
+        "share": {tier: stats["tiers"][tier] / stats["turns"] if stats["turns"] else 0.0 for tier in TIERS},
+        "mean_seconds": {
+            tier: stats["seconds"][tier] / stats["tiers"][tier] if stats["tiers"][tier] else 0.0 for tier in TIERS
+        },
+        "templates": dict(stats["templates"]),
+        "prompt_tokens_avoided": round(mean_prompt * (stats["turns"] - llm_turns)),
+    }
@@ -0,0 +1,175 @@
+"""
+Write-behind persistence for chat turns.
+
+handle_query hands each finished turn to enqueue_turn and returns without waiting for Neon.
+A background task batches queued turns and writes them with database.save_session_states.
+Until a turn is flushed, its session state is kept in memory and get_pending_state returns it,
+so the next turn of the same session (on this worker) reads its own writes.
+"""
+import asyncio
+import logging
+import random
+from config import (
+    WRITE_BEHIND_ENABLED, WRITE_BEHIND_MAX_PENDING, WRITE_BEHIND_BATCH_SIZE,
+    WRITE_BEHIND_FLUSH_INTERVAL, WRITE_BEHIND_ENQUEUE_TIMEOUT, WRITE_BEHIND_MAX_RETRIES
+)
+import database
+import conversation_memory
+
+_queue = None
+_flusher = None
+_pending = {}  # session_id -> [state dict, unflushed turns in order]
+# Held while turns are written, so a direct write can't overtake a batch in flight
+_write_lock = asyncio.Lock()
+
+def get_pending_state(session_id):
+    """Session state including turns not yet written, or None if nothing is pending"""
+    entry = _pending.get(session_id)
+    return dict(entry[0]) if entry else None
+
+def _remember(turn, previous_state):
+    entry = _pending.get(turn['session_id'])
+    state = entry[0] if entry else dict(previous_state or {})
+    state.update({
+        'name': turn['name'],
+        'phone': turn['phone'],
+        'summary': turn['summary'],
+        'turns': conversation_memory.add_turn(state.get('turns'), turn['user_message'], turn['bot_message'])
+    })
+    _pending[turn['session_id']] = [state, (entry[1] if entry else []) + [turn]]
+
+def _forget(turns):
+    for turn in turns:
+        entry = _pending.get(turn['session_id'])
+        if entry:
+            entry[1] = [pending for pending in entry[1] if pending is not turn]
+            if not entry[1]:
+                del _pending[turn['session_id']]
+
+async def _write_directly(turn):
+    # The session's older turns may still be queued; they are written first, in order, and
+    # marked so the flusher skips them when it dequeues them. _flush retries and splits like
+    # for a queued batch, so a failure drops at most the turn that keeps failing.
+    async with _write_lock:
+        entry = _pending.get(turn['session_id'])
+        turns = [pending for pending in (entry[1] if entry else [turn]) if not pending.get('written')]
+        for pending in turns:
+            pending['written'] = True
+        try:
+            await _flush(turns)
+        finally:
+            _forget(turns)
+
+async def enqueue_turn(session_id, name, phone, summary, user_message, bot_message, previous_state=None):
+    """
+    Queue a turn for persistence
+    
+    Waits up to WRITE_BEHIND_ENQUEUE_TIMEOUT when the queue is full (back-pressure), then
+    falls back to writing the turn directly, after the session's turns still in the queue.
+    Also writes directly when the writer isn't running.
+    
+    Args:
+        previous_state (dict, optional): The state the turn was built on, from load_session_state
+    """
+    turn = {
+        'session_id': session_id, 'name': name, 'phone': phone, 'summary': summary,
+        'user_message': user_message, 'bot_message': bot_message
+    }
+    if _flusher is None or _flusher.done():
+        await database.save_session_state(session_id, name, phone, summary, user_message, bot_message)
+        return
+    
+    # Remembered before the put, so the flusher can't forget the turn before it is remembered
+    _remember(turn, previous_state)
+    try:
+        await asyncio.wait_for(_queue.put(turn), timeout=WRITE_BEHIND_ENQUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        logging.warning(f"Write-behind queue full, writing session {session_id} directly")
+        # Shielded: the older turns are already marked written, so the write must finish
+        # even if the client goes away
+        try:
+            await asyncio.shield(asyncio.ensure_future(_write_directly(turn)))
+        except Exception as e:
+            # The reply is already built; losing its persistence shouldn't fail the request
+            logging.error(f"Direct write of session {session_id} failed: {e}")
+    except BaseException:
+        # Cancelled while waiting for room (e.g. the client went away): the turn was never
+        # queued, so its pending state must not outlive this call
+        _forget([turn])
+        raise
+
+async def _flush(batch, retries=WRITE_BEHIND_MAX_RETRIES):
+    """
+    Write a batch, retrying with backoff
+    
+    A batch that still fails is split in half and each half is written on its own (one
+    attempt each), so a turn Postgres always rejects (e.g. a NUL in a message) only
+    loses itself rather than every turn batched with it.
+    """
+    for attempt in range(retries + 1):
+        try:
+            await database.save_session_states(batch)
+            return
+        except Exception as e:
+            if attempt < retries:
+                delay = random.uniform(0, 0.5 * 2 ** attempt)
+                logging.warning(f"Write-behind flush failed (attempt {attempt + 1}), retrying in {delay:.2f}s: {e}")
+                await asyncio.sleep(delay)
+            elif len(batch) == 1:
+                logging.error(f"Dropping chat turn of session {batch[0]['session_id']} after {attempt + 1} failed writes: {e}")
+                return
+            else:
+                logging.warning(f"Write-behind flush of {len(batch)} turns failed, splitting the batch: {e}")
+    middle = len(batch) // 2
+    # Halves in order, so a session's turns keep their order
+    for part in (batch[:middle], batch[middle:]):
+        await _flush(part, retries=0)
+
+async def _run():
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _queue.get()]
+        deadline = loop.time() + WRITE_BEHIND_FLUSH_INTERVAL
+        while len(batch) < WRITE_BEHIND_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(_queue.get(), timeout=timeout))
+            except asyncio.TimeoutError:
+                break
+        try:
+            async with _write_lock:
+                # Turns already written by _write_directly are skipped
+                unwritten = [turn for turn in batch if not turn.get('written')]
+                for turn in unwritten:
+                    turn['written'] = True
+                if unwritten:
+                    await _flush(unwritten)
+        finally:
+            _forget(batch)
+            for _ in batch:
+                _queue.task_done()
+
+def start():
+    """Start the background writer on the running event loop"""
+    global _queue, _flusher
+    if not WRITE_BEHIND_ENABLED or _flusher is not None:
+        return
+    _queue = asyncio.Queue(maxsize=WRITE_BEHIND_MAX_PENDING)
+    _flusher = asyncio.create_task(_run())
+
+async def stop():
+    """Flush every queued turn, then stop the writer"""
+    global _queue, _flusher
+    if _flusher is None:
+        return
+    if not _flusher.done():
+        await _queue.join()
+    _flusher.cancel()
+    try:
+        await _flusher
+    except asyncio.CancelledError:
+        pass
+    _queue = None
+    _flusher = None
@@ -1,22 +1,73 @@
 import streamlit as st
 import asyncio
 import pandas as pd
+from datetime import timedelta
 
-from sqlite_db import init_sqlite_db, get_existing_session_ids, update_sqlite_with_sessions, display_sqlite_data
-from neon_db import fetch_neon_sessions
-from info_extractor import extract_user_info_llm
+from config import SYNC_OVERLAP_SECONDS, PAGE_SIZE
+from sqlite_db import (
+    init_sqlite_db, update_sqlite_with_sessions, display_sqlite_data, count_sessions, get_session_log,
+    search_sessions, count_search_results, get_sessions_needing_extraction,
+    get_sync_watermark, set_sync_watermark
+)
+from neon_db import fetch_changed_sessions
+from info_extractor import extract_user_infos
+from export import EXPORT_FORMATS, export_sessions
 
-async def sync_data():
+async def sync_data(on_progress=None):
+    """
+    Copy sessions changed since the last sync; returns how many were new or updated
+    
+    on_progress(synced, done, total) is called as each batch's extraction progresses.
+    """
     init_sqlite_db()
-    existing_session_ids = get_existing_session_ids()
-    neon_sessions = await fetch_neon_sessions()
+    previous_watermark = watermark = get_sync_watermark()
+    # Re-read a small window so writes that committed late aren't skipped
+    since = watermark - timedelta(seconds=SYNC_OVERLAP_SECONDS) if watermark else None
+    
+    synced = 0
+    def report(done, total):
+        if on_progress:
+            on_progress(synced, done, total)
     
-    new_sessions = [session for session in neon_sessions if session['session_id'] not in existing_session_ids]
+    # Sessions that fell back to regex extraction last time aren't past the watermark
+    # unless they changed, so they are retried here
+    retry = get_sessions_needing_extraction()
+    if retry:
+        user_infos, extracted = await extract_user_infos([session['summary'] for session in retry], report)
+        update_sqlite_with_sessions(retry, user_infos, extracted)
     
-    if new_sessions:
-        update_sqlite_with_sessions(new_sessions, extract_user_info_llm)
+    async for batch in fetch_changed_sessions(since):
+        user_infos, extracted = await extract_user_infos([session['summary'] for session in batch], report)
+        update_sqlite_with_sessions(batch, user_infos, extracted)
+        # Sessions from the overlap window were already counted by the previous sync
+        synced += sum(1 for session in batch if since is None or session['updated_at'] > previous_watermark)
+        latest = max(session['updated_at'] for session in batch)
+        if watermark is None or latest > watermark:
+            watermark = latest
+            set_sync_watermark(watermark)
         
-    return len(new_sessions)
+    return synced
+
+# Query results are cached across reruns; a sync clears them
+@st.cache_data(show_spinner=False)
+def load_page(filters, page):
+    return display_sqlite_data(dict(filters), limit=PAGE_SIZE, offset=page * PAGE_SIZE)
+
+@st.cache_data(show_spinner=False)
+def load_count(filters):
+    return count_sessions(dict(filters))
+
+@st.cache_data(show_spinner=False)
+def load_search_page(query, page):
+    return search_sessions(query, limit=PAGE_SIZE, offset=page * PAGE_SIZE)
+
+@st.cache_data(show_spinner=False)
+def load_search_count(query):
+    return count_search_results(query)
+
+@st.cache_data(show_spinner=False, max_entries=100)
+def load_log(session_id):
+    return get_session_log(session_id)
 
 def main():
     st.title("RK Nature Dashboard")
@@ -25,19 +76,27 @@ def main():
     
     if st.button("Refresh Data"):
         with st.spinner("Syncing data from Neon DB to SQLite..."):
-            new_sessions_count = asyncio.run(sync_data())
+            progress = st.progress(0.0, text="Fetching changed sessions...")
+            
+            def show_progress(synced, done, total):
+                progress.progress(
+                    done / total if total else 1.0,
+                    text=f"{synced} sessions synced; extracting user info {done}/{total} in this batch"
+                )
+            
+            new_sessions_count = asyncio.run(sync_data(show_progress))
+            progress.empty()
+            st.cache_data.clear()
             if new_sessions_count > 0:
-                st.success(f"✅ Synced {new_sessions_count} new sessions!")
+                st.success(f"✅ Synced {new_sessions_count} new or updated sessions!")
             else:
                 st.info("No new sessions to sync.")
     
     st.subheader("Total Number of Chats")
-    df = display_sqlite_data()
-    
-    st.write(f"Total Sessions: {len(df)}")
+    st.write(f"Total Sessions: {load_count(())}")
     
     st.subheader("Filter Options")
-    filter_col1, filter_col2 = st.columns(2)
+    filter_col1, filter_col2, filter_col3 = st.columns(3)
     
     with filter_col1:
         name_filter = st.text_input("Filter by Name")
@@ -45,17 +104,54 @@ def main():
     with filter_col2:
         product_filter = st.text_input("Filter by Product Interest")
     
-    filtered_df = df
-    if name_filter:
-        filtered_df = filtered_df[filtered_df['Name'].str.contains(name_filter, case=False, na=False)]
-    if product_filter:
-        filtered_df = filtered_df[filtered_df['Product'].str.contains(product_filter, case=False, na=False)]
+    with filter_col3:
+        summary_filter = st.text_input("Filter by Summary")
+    
+    # A tuple of pairs, so it can be part of the cache key
+    filters = tuple((column, text) for column, text in (
+        ("name", name_filter), ("product", product_filter), ("summary", summary_filter)
+    ) if text)
+    
+    matching = load_count(filters)
+    pages = max(1, -(-matching // PAGE_SIZE))
+    page = st.number_input(f"Page (of {pages}, {matching} matching sessions)", min_value=1, max_value=pages, value=1) - 1
+    filtered_df = load_page(filters, page)
+    
+    st.dataframe(filtered_df, hide_index=True)
+    
+    if not filtered_df.empty:
+        session_id = st.selectbox("View transcript", filtered_df["Session"])
+        st.text(load_log(session_id) or "")
     
-    st.dataframe(filtered_df)
+    st.subheader("Search Conversations")
+    search_query = st.text_input("Search transcripts and summaries", placeholder="e.g. diabetes or 98765")
+    if search_query:
+        hits = load_search_count(search_query)
+        if hits:
+            search_pages = max(1, -(-hits // PAGE_SIZE))
+            search_page = st.number_input(
+                f"Results page (of {search_pages}, {hits} matching sessions)",
+                min_value=1, max_value=search_pages, value=1
+            ) - 1
+            results = load_search_page(search_query, search_page)
+            for row in results.to_dict("records"):
+                st.markdown(f"**{row['Name'] or 'Unknown'}** ({row['Number'] or 'no number'}) · {row['Last Updated']}  \n{row['Snippet']}")
+                with st.expander(f"Transcript {row['Session']}"):
+                    st.text(load_log(row['Session']) or "")
+        else:
+            st.info("No sessions match that search.")
     
-    if st.button("Export to CSV"):
-        filtered_df.to_csv("chat_sessions_export.csv", index=False)
-        st.success("Data exported to chat_sessions_export.csv!")
+    st.subheader("Export")
+    export_format = st.radio("Format", list(EXPORT_FORMATS), horizontal=True)
+    extension, mime = EXPORT_FORMATS[export_format]
+    # The file is only built when the button is clicked, on a separate thread
+    st.download_button(
+        f"Export {matching} sessions",
+        data=lambda: export_sessions(dict(filters), export_format),
+        file_name=f"chat_sessions_export.{extension}",
+        mime=mime,
+        on_click="ignore",
+    )
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
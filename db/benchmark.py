@@ -0,0 +1,97 @@
+"""
+Offline benchmarks for the dashboard's SQLite store.
+
+Usage:
+    python benchmark.py search [--sizes 1000 10000 100000] [--queries 100]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import sqlite_db
+
+SEARCH_TERMS = ["diabetes", "back pain", "yoga", "detox", "98765", "weight loss", "arthritis", "panchakarma"]
+FILLER = (
+    "User: what treatments do you offer | Bot: We offer naturopathy, yoga and diet therapy. "
+    "User: how long is the stay | Bot: Most programmes run for 7 to 21 days. "
+)
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def _report(label, samples):
+    print(
+        f"{label:<14} n={len(samples):<5} "
+        f"p50={_percentile(samples, 50) * 1000:8.2f}ms "
+        f"p95={_percentile(samples, 95) * 1000:8.2f}ms "
+        f"p99={_percentile(samples, 99) * 1000:8.2f}ms"
+    )
+
+def _synthetic_sessions(count):
+    rng = random.Random(count)
+    sessions, user_infos = [], []
+    for i in range(count):
+        topic = rng.choice(SEARCH_TERMS[:4] + SEARCH_TERMS[5:])
+        phone = f"9{rng.randrange(10 ** 9):09d}"
+        log = f"{FILLER * rng.randint(2, 8)}User: I have {topic}, my number is {phone} | Bot: Thank you!"
+        sessions.append({'session_id': f"bench-{i}", 'log': log, 'summary': f"User asked about {topic} treatment."})
+        user_infos.append((f"User {i}", phone, topic))
+    return sessions, user_infos
+
+# FTS5 search vs a LIKE scan over the transcripts
+def bench_search(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            sqlite_db.SQLITE_DB_FILE = os.path.join(tmp, f"bench-{size}.db")
+            sqlite_db.init_sqlite_db().close()
+            sessions, user_infos = _synthetic_sessions(size)
+
+            start = time.perf_counter()
+            sqlite_db.update_sqlite_with_sessions(sessions, user_infos)
+            print(f"\n{size} sessions (indexed in {time.perf_counter() - start:.2f}s)")
+
+            queries = [random.choice(SEARCH_TERMS) for _ in range(args.queries)]
+            fts, like = [], []
+            for query in queries:
+                start = time.perf_counter()
+                sqlite_db.count_search_results(query)
+                sqlite_db.search_sessions(query, limit=20)
+                fts.append(time.perf_counter() - start)
+
+            conn = sqlite3.connect(sqlite_db.SQLITE_DB_FILE)
+            for query in queries[:max(1, args.queries // 10)]:
+                start = time.perf_counter()
+                conn.execute(
+                    "SELECT session_id FROM chat_sessions WHERE log LIKE ? OR summary LIKE ? LIMIT 20",
+                    (f"%{query}%", f"%{query}%")
+                ).fetchall()
+                conn.execute(
+                    "SELECT COUNT(*) FROM chat_sessions WHERE log LIKE ? OR summary LIKE ?",
+                    (f"%{query}%", f"%{query}%")
+                ).fetchone()
+                like.append(time.perf_counter() - start)
+            conn.close()
+
+            _report("fts5 search", fts)
+            _report("LIKE scan", like)
+
+def main():
+    parser = argparse.ArgumentParser(description="RK Nature dashboard benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    search_parser = subparsers.add_parser("search", help="full-text search latency vs corpus size")
+    search_parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="number of sessions")
+    search_parser.add_argument("--queries", type=int, default=100)
+    search_parser.set_defaults(func=bench_search)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -14,7 +14,18 @@ NEON_DB_NAME = os.getenv("NEON_DB_NAME")
 
 # SQLite configuration
 SQLITE_DB_FILE = "chat_sessions.db"
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "50"))  # dashboard rows per page
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))  # rows per export read
+
+# Incremental Neon -> SQLite sync
+SYNC_BATCH_SIZE = int(os.getenv("SYNC_BATCH_SIZE", "500"))  # rows per cursor fetch
+SYNC_OVERLAP_SECONDS = int(os.getenv("SYNC_OVERLAP_SECONDS", "60"))  # re-read window for late-committing writes
 
 # Groq API key for LLM
 API_KEY = os.getenv("API_KEY")
-llm = Groq(model="llama3-70b-8192", api_key=API_KEY)
\ No newline at end of file
+llm = Groq(model="llama3-70b-8192", api_key=API_KEY)
+
+# Dashboard user-info extraction
+EXTRACTION_CONCURRENCY = int(os.getenv("EXTRACTION_CONCURRENCY", "8"))  # prompts in flight
+EXTRACTION_BATCH_SIZE = int(os.getenv("EXTRACTION_BATCH_SIZE", "10"))  # summaries per prompt
+EXTRACTION_MAX_RETRIES = int(os.getenv("EXTRACTION_MAX_RETRIES", "3"))  # retries on rate-limit errors
\ No newline at end of file
@@ -0,0 +1,49 @@
+import tempfile
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from config import EXPORT_CHUNK_SIZE
+from sqlite_db import EXPORT_COLUMNS, iter_export_chunks
+
+EXPORT_FORMATS = {
+    "CSV": ("csv", "text/csv"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+
+# Every column is text in SQLite; a fixed schema keeps all-null chunks from changing the type
+PARQUET_SCHEMA = pa.schema([(column, pa.string()) for column in EXPORT_COLUMNS])
+
+def write_csv(filters, out, chunk_size=EXPORT_CHUNK_SIZE):
+    header = True
+    for chunk in iter_export_chunks(filters, chunk_size):
+        out.write(chunk.to_csv(index=False, header=header).encode("utf-8"))
+        header = False
+    if header:
+        out.write(pd.DataFrame(columns=EXPORT_COLUMNS).to_csv(index=False).encode("utf-8"))
+
+def write_parquet(filters, out, chunk_size=EXPORT_CHUNK_SIZE):
+    with pq.ParquetWriter(out, PARQUET_SCHEMA) as writer:
+        for chunk in iter_export_chunks(filters, chunk_size):
+            writer.write_table(pa.Table.from_pandas(chunk.astype(object), schema=PARQUET_SCHEMA, preserve_index=False))
+
+def export_sessions(filters, export_format):
+    """
+    Write the filtered sessions to a temporary file, one chunk at a time
+
+    Args:
+        filters (dict): Same filters as display_sqlite_data
+        export_format (str): "CSV" or "Parquet"
+
+    Returns:
+        bytes: The exported file. Streamlit keeps downloads in memory as bytes anyway
+            (it rejects temp file objects), so only the DataFrames are kept chunk-sized.
+    """
+    with tempfile.TemporaryFile() as out:
+        if export_format == "Parquet":
+            write_parquet(filters, out)
+        else:
+            write_csv(filters, out)
+        out.seek(0)
+        return out.read()
@@ -1,9 +1,15 @@
 import re
 import json
-from config import llm
+import random
+import asyncio
+import hashlib
+from config import llm, EXTRACTION_CONCURRENCY, EXTRACTION_BATCH_SIZE, EXTRACTION_MAX_RETRIES
+from sqlite_db import get_cached_user_infos, cache_user_infos
 
-def extract_user_info_llm(summary):
-    prompt = f"""
+UNKNOWN_INFO = ("Unknown", "Unknown", "Unknown")
+
+def extract_user_info_prompt(summary):
+    return f"""
     Extract the following information from this summary:
     1. User's name
     2. User's phone number
@@ -14,18 +20,6 @@ def extract_user_info_llm(summary):
     Format your response as a valid JSON with these keys: "name", "phone", "product"
     If any information is not available, use "Unknown" as the value.
     """
-    
-    try:
-        response = llm.complete(prompt).text.strip()
-        json_match = re.search(r'({.*})', response, re.DOTALL)
-        if json_match:
-            json_str = json_match.group(1)
-            data = json.loads(json_str)
-            return data.get("name", "Unknown"), data.get("phone", "Unknown"), data.get("product", "Unknown")
-        else:
-            return extract_user_info_regex(summary)
-    except Exception:
-        return extract_user_info_regex(summary)
 
 def extract_user_info_regex(summary):
     name = "Unknown"
@@ -44,4 +38,124 @@ def extract_user_info_regex(summary):
     if product_match and product_match.group(1).strip() != "Unknown":
         product = product_match.group(1).strip()
     
-    return name, phone, product
\ No newline at end of file
+    return name, phone, product
+
+def summary_hash(summary):
+    return hashlib.sha256((summary or "").encode("utf-8")).hexdigest()
+
+def _is_rate_limit_error(error):
+    message = str(error).lower()
+    return getattr(error, "status_code", None) == 429 or "429" in message or "rate limit" in message
+
+async def _complete(prompt, slots):
+    """Async LLM call, bounded by the semaphore, retrying rate-limit errors with jittered backoff"""
+    for attempt in range(EXTRACTION_MAX_RETRIES + 1):
+        try:
+            async with slots:
+                return (await llm.acomplete(prompt)).text.strip()
+        except Exception as e:
+            if attempt == EXTRACTION_MAX_RETRIES or not _is_rate_limit_error(e):
+                raise
+            await asyncio.sleep(random.uniform(0, 2 ** attempt))
+
+def _info_from_json(data):
+    return data.get("name", "Unknown"), data.get("phone", "Unknown"), data.get("product", "Unknown")
+
+async def _extract_one(summary, slots):
+    """
+    Returns:
+        tuple: ((name, phone, product), from_llm); from_llm is False when the LLM call
+            failed or its answer wasn't JSON and the regex fallback was used
+    """
+    try:
+        response = await _complete(extract_user_info_prompt(summary), slots)
+        json_match = re.search(r'({.*})', response, re.DOTALL)
+        if json_match:
+            return _info_from_json(json.loads(json_match.group(1))), True
+    except Exception:
+        pass
+    return extract_user_info_regex(summary), False
+
+async def _extract_batch(summaries, slots):
+    """
+    Extract several summaries with one prompt; falls back to one call per summary
+
+    Returns:
+        list: ((name, phone, product), from_llm) per summary, as _extract_one
+    """
+    if len(summaries) == 1:
+        return [await _extract_one(summaries[0], slots)]
+    numbered = "\n".join(f'{i + 1}. "{summary}"' for i, summary in enumerate(summaries))
+    prompt = f"""
+    For each of the following {len(summaries)} numbered summaries, extract:
+    1. User's name
+    2. User's phone number
+    3. What product or service the user is interested in
+
+    Summaries:
+    {numbered}
+
+    Format your response as a valid JSON array with exactly one object per summary, in the same order,
+    each with these keys: "name", "phone", "product"
+    If any information is not available, use "Unknown" as the value.
+    """
+    try:
+        response = await _complete(prompt, slots)
+        json_match = re.search(r'(\[.*\])', response, re.DOTALL)
+        items = json.loads(json_match.group(1)) if json_match else None
+        if isinstance(items, list) and len(items) == len(summaries) and all(isinstance(item, dict) for item in items):
+            return [(_info_from_json(item), True) for item in items]
+    except Exception:
+        pass
+    return list(await asyncio.gather(*(_extract_one(summary, slots) for summary in summaries)))
+
+async def extract_user_infos(summaries, on_progress=None):
+    """
+    Extract (name, phone, product) for many summaries concurrently
+    
+    LLM results are cached by summary hash, so unchanged summaries are never sent to the LLM
+    again. Regex fallbacks (LLM outage, retries exhausted) are not cached; the caller stores
+    them flagged for re-extraction. Uncached summaries go out EXTRACTION_BATCH_SIZE per
+    prompt, with at most EXTRACTION_CONCURRENCY prompts in flight.
+    
+    Args:
+        summaries (list): Summary texts
+        on_progress (callable, optional): Called as on_progress(done, total) while extracting
+    
+    Returns:
+        tuple: (user_infos, extracted): (name, phone, product) per summary, in the same
+            order, and whether each is final (False for regex fallbacks)
+    """
+    hashes = [summary_hash(summary) for summary in summaries]
+    results = get_cached_user_infos(set(hashes))
+    fallbacks = set()
+    
+    pending = {}
+    for summary, digest in zip(summaries, hashes):
+        if digest in results:
+            continue
+        if not summary:
+            results[digest] = UNKNOWN_INFO
+        else:
+            pending[digest] = summary
+    
+    slots = asyncio.Semaphore(EXTRACTION_CONCURRENCY)
+    digests = list(pending)
+    batches = [digests[i:i + EXTRACTION_BATCH_SIZE] for i in range(0, len(digests), EXTRACTION_BATCH_SIZE)]
+    
+    async def run(batch):
+        return batch, await _extract_batch([pending[digest] for digest in batch], slots)
+    
+    done = 0
+    if on_progress:
+        on_progress(done, len(digests))
+    for finished in asyncio.as_completed([run(batch) for batch in batches]):
+        batch, infos = await finished
+        cache_user_infos({digest: info for digest, (info, from_llm) in zip(batch, infos) if from_llm})
+        results.update((digest, info) for digest, (info, _) in zip(batch, infos))
+        fallbacks.update(digest for digest, (_, from_llm) in zip(batch, infos) if not from_llm)
+        done += len(batch)
+        if on_progress:
+            on_progress(done, len(digests))
+    
+    return [tuple(results[digest]) for digest in hashes], [digest not in fallbacks for digest in hashes]
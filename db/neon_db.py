@@ -1,5 +1,5 @@
 import asyncpg
-from config import NEON_DB_USER, NEON_DB_PASSWORD, NEON_DB_HOST, NEON_DB_PORT, NEON_DB_NAME
+from config import NEON_DB_USER, NEON_DB_PASSWORD, NEON_DB_HOST, NEON_DB_PORT, NEON_DB_NAME, SYNC_BATCH_SIZE
 
 async def connect_to_neon():
     conn = await asyncpg.connect(
@@ -11,10 +11,44 @@ async def connect_to_neon():
     )
     return conn
 
-async def fetch_neon_sessions():
+# Older turns live in chat_logs.log; newer ones are appended to chat_messages
+SESSIONS_SQL = """
+    SELECT c.session_id,
+           concat_ws(' | ', NULLIF(c.log, ''), m.log) AS log,
+           c.summary,
+           c.updated_at
+    FROM chat_logs c
+    LEFT JOIN LATERAL (
+        SELECT string_agg('User: ' || user_message || ' | Bot: ' || bot_message, ' | ' ORDER BY turn_index) AS log
+        FROM chat_messages
+        WHERE session_id = c.session_id
+    ) m ON true
+"""
+
+async def fetch_changed_sessions(since=None, batch_size=SYNC_BATCH_SIZE):
+    """
+    Stream sessions updated after a watermark, in batches, through a server-side cursor
+    
+    Args:
+        since (datetime, optional): Only sessions with updated_at after this (all if None)
+        batch_size (int): Rows fetched per round-trip
+    
+    Yields:
+        list: Batches of session dicts (session_id, log, summary, updated_at), oldest first
+    """
     conn = await connect_to_neon()
     try:
-        rows = await conn.fetch("SELECT session_id, log, summary FROM chat_logs")
-        return [dict(row) for row in rows]
+        async with conn.transaction():
+            if since is None:
+                cursor = await conn.cursor(f"{SESSIONS_SQL} ORDER BY c.updated_at, c.session_id")
+            else:
+                cursor = await conn.cursor(
+                    f"{SESSIONS_SQL} WHERE c.updated_at > $1 ORDER BY c.updated_at, c.session_id", since
+                )
+            while True:
+                rows = await cursor.fetch(batch_size)
+                if not rows:
+                    break
+                yield [dict(row) for row in rows]
     finally:
-        await conn.close()
\ No newline at end of file
+        await conn.close()
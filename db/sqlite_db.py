@@ -1,63 +1,394 @@
+import re
 import sqlite3
 import pandas as pd
+from datetime import datetime
 from config import SQLITE_DB_FILE
 
+# id is an INTEGER PRIMARY KEY (the rowid itself), so VACUUM never renumbers the keys
+# the full-text indexes are joined on
+CREATE_SESSIONS_TABLE = '''
+CREATE TABLE IF NOT EXISTS chat_sessions (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL UNIQUE,
+    log TEXT,
+    summary TEXT,
+    name TEXT,
+    phone TEXT,
+    product TEXT,
+    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    needs_extraction INTEGER NOT NULL DEFAULT 0
+)
+'''
+
+def _add_session_ids(cursor):
+    """Rebuild a chat_sessions table from before the id column; its indexes are rebuilt after"""
+    cursor.execute("ALTER TABLE chat_sessions RENAME TO chat_sessions_old")
+    cursor.execute(CREATE_SESSIONS_TABLE)
+    cursor.execute('''
+    INSERT INTO chat_sessions (session_id, log, summary, name, phone, product, last_updated)
+    SELECT session_id, log, summary, name, phone, product, last_updated FROM chat_sessions_old
+    ''')
+    cursor.execute("DROP TABLE chat_sessions_old")
+    cursor.execute("DROP TABLE IF EXISTS chat_sessions_filter")
+    cursor.execute("DROP TABLE IF EXISTS chat_sessions_search")
+    cursor.execute("DROP TABLE IF EXISTS chat_sessions_numbers")
+
+DIGIT_SEPARATOR_PATTERN = re.compile(r"(?<=\d)[\s-](?=\d)")
+NUMBER_PATTERN = re.compile(r"\d{3,}")
+
+def session_numbers(log, summary):
+    """The numbers in a session, separators dropped ("98765 43210" -> "9876543210"), space-joined"""
+    text = DIGIT_SEPARATOR_PATTERN.sub("", f"{log or ''}\n{summary or ''}")
+    return " ".join(dict.fromkeys(NUMBER_PATTERN.findall(text)))
+
 def init_sqlite_db():
     conn = sqlite3.connect(SQLITE_DB_FILE)
     cursor = conn.cursor()
     
+    cursor.execute(CREATE_SESSIONS_TABLE)
+    if "id" not in {column[1] for column in cursor.execute("PRAGMA table_info(chat_sessions)")}:
+        _add_session_ids(cursor)
+    # Set when name/phone/product came from the regex fallback; the next sync re-extracts them
+    if "needs_extraction" not in {column[1] for column in cursor.execute("PRAGMA table_info(chat_sessions)")}:
+        cursor.execute("ALTER TABLE chat_sessions ADD COLUMN needs_extraction INTEGER NOT NULL DEFAULT 0")
+    
+    cursor.execute("CREATE INDEX IF NOT EXISTS chat_sessions_last_updated_idx ON chat_sessions (last_updated, session_id)")
+    
+    # Trigram full-text index so the dashboard's substring filters don't scan the table
+    filter_index_exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'chat_sessions_filter'"
+    ).fetchone()
+    if not filter_index_exists:
+        cursor.execute('''
+        CREATE VIRTUAL TABLE chat_sessions_filter USING fts5(
+            name, product, summary, tokenize = 'trigram'
+        )
+        ''')
+        # Index rows are keyed by chat_sessions.id
+        cursor.execute('''
+        INSERT INTO chat_sessions_filter (rowid, name, product, summary)
+        SELECT id, name, product, summary FROM chat_sessions
+        ''')
+    
+    # Word-level full-text index over transcripts and summaries for the search box
+    search_index_exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'chat_sessions_search'"
+    ).fetchone()
+    if not search_index_exists:
+        cursor.execute('''
+        CREATE VIRTUAL TABLE chat_sessions_search USING fts5(
+            log, summary, tokenize = 'unicode61', prefix = '2 3'
+        )
+        ''')
+        cursor.execute('''
+        INSERT INTO chat_sessions_search (rowid, log, summary)
+        SELECT id, log, summary FROM chat_sessions
+        ''')
+    
+    # Trigram index over the numbers in transcripts and summaries, so a phone fragment
+    # matches anywhere inside a number (the word index only matches prefixes)
+    numbers_index_exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'chat_sessions_numbers'"
+    ).fetchone()
+    if not numbers_index_exists:
+        cursor.execute("CREATE VIRTUAL TABLE chat_sessions_numbers USING fts5(numbers, tokenize = 'trigram')")
+        conn.create_function("session_numbers", 2, session_numbers, deterministic=True)
+        cursor.execute('''
+        INSERT INTO chat_sessions_numbers (rowid, numbers)
+        SELECT id, session_numbers(log, summary) FROM chat_sessions
+        ''')
+    
+    # LLM extraction results keyed by a hash of the summary they came from
     cursor.execute('''
-    CREATE TABLE IF NOT EXISTS chat_sessions (
-        session_id TEXT PRIMARY KEY,
-        log TEXT,
-        summary TEXT,
+    CREATE TABLE IF NOT EXISTS extraction_cache (
+        summary_hash TEXT PRIMARY KEY,
         name TEXT,
         phone TEXT,
-        product TEXT,
-        last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        product TEXT
+    )
+    ''')
+    
+    # Sync watermark (latest Neon updated_at already copied)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sync_state (
+        key TEXT PRIMARY KEY,
+        value TEXT
     )
     ''')
     
     conn.commit()
     return conn
 
-def get_existing_session_ids():
+def get_sync_watermark():
     conn = sqlite3.connect(SQLITE_DB_FILE)
     cursor = conn.cursor()
-    cursor.execute("SELECT session_id FROM chat_sessions")
-    session_ids = [row[0] for row in cursor.fetchall()]
+    cursor.execute("SELECT value FROM sync_state WHERE key = 'neon_updated_at'")
+    row = cursor.fetchone()
+    conn.close()
+    return datetime.fromisoformat(row[0]) if row else None
+
+def set_sync_watermark(updated_at):
+    conn = sqlite3.connect(SQLITE_DB_FILE)
+    conn.execute(
+        "INSERT OR REPLACE INTO sync_state (key, value) VALUES ('neon_updated_at', ?)",
+        (updated_at.isoformat(),)
+    )
+    conn.commit()
     conn.close()
-    return session_ids
 
-def update_sqlite_with_sessions(sessions, extract_user_info_func):
+def update_sqlite_with_sessions(sessions, user_infos, extracted=None):
+    """
+    Upsert synced sessions
+    
+    Args:
+        sessions (list): Session dicts with session_id, log and summary
+        user_infos (list): (name, phone, product) for each session, in the same order
+        extracted (list, optional): False for each session whose info came from the regex
+            fallback, so it is re-extracted on the next sync (all True if None)
+    """
     conn = sqlite3.connect(SQLITE_DB_FILE)
     cursor = conn.cursor()
     
-    for session in sessions:
-        session_id = session['session_id']
-        log = session['log']
-        summary = session['summary']
-        
-        name, phone, product = extract_user_info_func(summary)
-        
-        cursor.execute('''
-        INSERT OR REPLACE INTO chat_sessions 
-        (session_id, log, summary, name, phone, product, last_updated)
-        VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-        ''', (session_id, log, summary, name, phone, product))
+    for session, (name, phone, product), from_llm in zip(sessions, user_infos, extracted or [True] * len(sessions)):
+        # Upsert in place so the session keeps its id (and its index row keys)
+        session_key = cursor.execute('''
+        INSERT INTO chat_sessions 
+        (session_id, log, summary, name, phone, product, last_updated, needs_extraction)
+        VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?)
+        ON CONFLICT (session_id) DO UPDATE SET
+            log = excluded.log, summary = excluded.summary, name = excluded.name,
+            phone = excluded.phone, product = excluded.product, last_updated = excluded.last_updated,
+            needs_extraction = excluded.needs_extraction
+        RETURNING id
+        ''', (session['session_id'], session['log'], session['summary'], name, phone, product,
+              int(not from_llm))).fetchone()[0]
+        cursor.execute("DELETE FROM chat_sessions_filter WHERE rowid = ?", (session_key,))
+        cursor.execute(
+            "INSERT INTO chat_sessions_filter (rowid, name, product, summary) VALUES (?, ?, ?, ?)",
+            (session_key, name, product, session['summary'])
+        )
+        cursor.execute("DELETE FROM chat_sessions_search WHERE rowid = ?", (session_key,))
+        cursor.execute(
+            "INSERT INTO chat_sessions_search (rowid, log, summary) VALUES (?, ?, ?)",
+            (session_key, session['log'], session['summary'])
+        )
+        cursor.execute("DELETE FROM chat_sessions_numbers WHERE rowid = ?", (session_key,))
+        cursor.execute(
+            "INSERT INTO chat_sessions_numbers (rowid, numbers) VALUES (?, ?)",
+            (session_key, session_numbers(session['log'], session['summary']))
+        )
     
     conn.commit()
     conn.close()
 
-def display_sqlite_data():
+def get_sessions_needing_extraction():
+    """Sessions whose user info came from the regex fallback, as session dicts"""
+    conn = sqlite3.connect(SQLITE_DB_FILE)
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute(
+        "SELECT session_id, log, summary FROM chat_sessions WHERE needs_extraction = 1"
+    ).fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+def get_cached_user_infos(summary_hashes):
+    """Return {summary_hash: (name, phone, product)} for the hashes already extracted"""
+    conn = sqlite3.connect(SQLITE_DB_FILE)
+    cursor = conn.cursor()
+    found = {}
+    hashes = list(summary_hashes)
+    # Stay under SQLite's bound-parameter limit
+    for start in range(0, len(hashes), 500):
+        chunk = hashes[start:start + 500]
+        cursor.execute(
+            f"SELECT summary_hash, name, phone, product FROM extraction_cache WHERE summary_hash IN ({','.join('?' * len(chunk))})",
+            chunk
+        )
+        found.update({row[0]: row[1:] for row in cursor.fetchall()})
+    conn.close()
+    return found
+
+def cache_user_infos(user_infos):
+    """Store {summary_hash: (name, phone, product)}"""
+    conn = sqlite3.connect(SQLITE_DB_FILE)
+    conn.executemany(
+        "INSERT OR REPLACE INTO extraction_cache (summary_hash, name, phone, product) VALUES (?, ?, ?, ?)",
+        [(summary_hash, *info) for summary_hash, info in user_infos.items()]
+    )
+    conn.commit()
+    conn.close()
+
+# Substring filters: trigram FTS match for 3+ characters, LIKE scan for shorter text
+FILTER_COLUMNS = ("name", "product", "summary")
+
+def _filter_clause(filters):
+    conditions = []
+    params = []
+    for column, text in filters.items():
+        if column not in FILTER_COLUMNS or not text:
+            continue
+        if len(text) >= 3:
+            conditions.append(
+                "id IN (SELECT rowid FROM chat_sessions_filter WHERE chat_sessions_filter MATCH ?)"
+            )
+            params.append(f'{column} : "{text.replace(chr(34), chr(34) * 2)}"')
+        else:
+            conditions.append(f"{column} LIKE ?")
+            params.append(f"%{text}%")
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return where, params
+
+def count_sessions(filters=None):
+    where, params = _filter_clause(filters or {})
     conn = sqlite3.connect(SQLITE_DB_FILE)
-    df = pd.read_sql_query("""
-        SELECT name AS Name, 
+    count = conn.execute(f"SELECT COUNT(*) FROM chat_sessions {where}", params).fetchone()[0]
+    conn.close()
+    return count
+
+def display_sqlite_data(filters=None, limit=None, offset=0):
+    """
+    Load one page of sessions with the columns the dashboard shows (no transcripts)
+    
+    Args:
+        filters (dict, optional): {"name"|"product"|"summary": substring}
+        limit (int, optional): Page size (all rows if None)
+        offset (int): Rows to skip
+    
+    Returns:
+        DataFrame: Newest sessions first
+    """
+    where, params = _filter_clause(filters or {})
+    conn = sqlite3.connect(SQLITE_DB_FILE)
+    df = pd.read_sql_query(f"""
+        SELECT session_id AS "Session", 
+               name AS Name, 
                phone AS Number, 
                product AS Product, 
                summary AS Summary, 
-               log AS Log 
+               last_updated AS "Last Updated" 
         FROM chat_sessions
-    """, conn)
+        {where}
+        ORDER BY last_updated DESC, session_id DESC
+        LIMIT ? OFFSET ?
+    """, conn, params=[*params, -1 if limit is None else limit, offset])
+    conn.close()
+    return df
+
+EXPORT_COLUMNS = ["Session", "Name", "Number", "Product", "Summary", "Log", "Last Updated"]
+
+def iter_export_chunks(filters=None, chunk_size=1000):
+    """
+    Stream filtered sessions, transcripts included, in fixed-size chunks
+    
+    Args:
+        filters (dict, optional): Same filters as display_sqlite_data
+        chunk_size (int): Rows per DataFrame
+    
+    Yields:
+        DataFrame: At most chunk_size rows, newest sessions first
+    """
+    where, params = _filter_clause(filters or {})
+    conn = sqlite3.connect(SQLITE_DB_FILE)
+    try:
+        yield from pd.read_sql_query(f"""
+            SELECT session_id AS "Session", 
+                   name AS Name, 
+                   phone AS Number, 
+                   product AS Product, 
+                   summary AS Summary, 
+                   log AS Log, 
+                   last_updated AS "Last Updated" 
+            FROM chat_sessions
+            {where}
+            ORDER BY last_updated DESC, session_id DESC
+        """, conn, params=params, chunksize=chunk_size)
+    finally:
+        conn.close()
+
+def _search_terms(query):
+    """
+    Split free text into FTS5 queries: every word must appear, as a word or word prefix;
+    digit-only terms of 3+ characters (phone fragments) may appear anywhere inside a number
+    
+    Returns:
+        tuple: (word query, number query); either may be ""
+    """
+    words, numbers = [], []
+    for term in re.findall(r"\w+", query):
+        (numbers if term.isdigit() and len(term) >= 3 else words).append(term)
+    return " ".join(f'"{word}"*' for word in words), " ".join(f'"{number}"' for number in numbers)
+
+def _search_source(query):
+    """
+    FROM/WHERE clause, parameters, snippet and ordering for a search
+    
+    Returns:
+        tuple: (sql, params, snippet, order), or None for a query with no terms
+    """
+    words, numbers = _search_terms(query)
+    number_filter = "s.id IN (SELECT rowid FROM chat_sessions_numbers WHERE chat_sessions_numbers MATCH ?)"
+    if words:
+        sql = """
+            FROM chat_sessions_search
+            JOIN chat_sessions s ON s.id = chat_sessions_search.rowid
+            WHERE chat_sessions_search MATCH ?"""
+        # bm25 weights: a hit in the summary counts more than one buried in the transcript
+        source = (sql, [words], "snippet(chat_sessions_search, -1, '**', '**', '…', 16)",
+                  "bm25(chat_sessions_search, 1.0, 2.0)")
+        if numbers:
+            source = (f"{sql} AND {number_filter}", [words, numbers], *source[2:])
+        return source
+    if numbers:
+        # Only numbers: show the matching numbers, newest sessions first
+        return ("""
+            FROM chat_sessions s
+            JOIN chat_sessions_numbers ON chat_sessions_numbers.rowid = s.id
+            WHERE chat_sessions_numbers MATCH ?""", [numbers],
+                "highlight(chat_sessions_numbers, 0, '**', '**')", "s.last_updated DESC, s.session_id DESC")
+    return None
+
+def count_search_results(query):
+    source = _search_source(query)
+    if source is None:
+        return 0
+    sql, params, _, _ = source
+    conn = sqlite3.connect(SQLITE_DB_FILE)
+    count = conn.execute(f"SELECT COUNT(*) {sql}", params).fetchone()[0]
+    conn.close()
+    return count
+
+def search_sessions(query, limit=20, offset=0):
+    """
+    Full-text search over transcripts and summaries
+    
+    Args:
+        query (str): Free text, e.g. "diabetes" or a phone fragment
+        limit (int): Page size
+        offset (int): Rows to skip
+    
+    Returns:
+        DataFrame: Best matches first, with the matched terms in bold in the snippet
+    """
+    source = _search_source(query)
+    if source is None:
+        return pd.DataFrame(columns=["Session", "Name", "Number", "Snippet", "Last Updated"])
+    sql, params, snippet, order = source
+    conn = sqlite3.connect(SQLITE_DB_FILE)
+    df = pd.read_sql_query(f"""
+        SELECT s.session_id AS "Session", 
+               s.name AS Name, 
+               s.phone AS Number, 
+               {snippet} AS Snippet, 
+               s.last_updated AS "Last Updated" 
+        {sql}
+        ORDER BY {order}
+        LIMIT ? OFFSET ?
+    """, conn, params=[*params, limit, offset])
+    conn.close()
+    return df
+
+def get_session_log(session_id):
+    conn = sqlite3.connect(SQLITE_DB_FILE)
+    row = conn.execute("SELECT log FROM chat_sessions WHERE session_id = ?", (session_id,)).fetchone()
     conn.close()
-    return df
\ No newline at end of file
+    return row[0] if row else None
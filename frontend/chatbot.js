@@ -296,8 +296,8 @@ const ChatbotWidget = {
     this.elements.input.value = ""
     this.showTypingIndicator()
 
-    // Send to backend
-    fetch(this.config.apiUrl, {
+    // Stream the reply from the backend as it is generated
+    fetch(`${this.config.apiUrl}/stream`, {
       method: "POST",
       headers: { "Content-Type": "application/json" },
       body: JSON.stringify({
@@ -305,10 +305,18 @@ const ChatbotWidget = {
         Query: query,
       }),
     })
-      .then((response) => response.json())
-      .then((data) => {
-        this.removeTypingIndicator()
-        this.addBotMessage(data.response)
+      .then(async (response) => {
+        if (response.status === 429 || response.status === 503) {
+          // Rate-limited or busy: the server still sends a short canned reply
+          const data = await response.json()
+          this.removeTypingIndicator()
+          this.addBotMessage(data.response)
+          return
+        }
+        if (!response.ok || !response.body) {
+          throw new Error(`HTTP ${response.status}`)
+        }
+        return this.readReplyStream(response.body)
       })
       .catch((error) => {
         this.removeTypingIndicator()
@@ -316,6 +324,54 @@ const ChatbotWidget = {
       })
   },
 
+  // Read server-sent events, growing one bot message as tokens arrive
+  async readReplyStream(body) {
+    const reader = body.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ""
+    let msg = null
+
+    const showMessage = () => {
+      if (!msg) {
+        this.removeTypingIndicator()
+        msg = this.addBotMessage("")
+      }
+      return msg
+    }
+
+    while (true) {
+      const { done, value } = await reader.read()
+      if (done) break
+      buffer += decoder.decode(value, { stream: true })
+
+      // Events are separated by a blank line; keep any partial event for the next read
+      const events = buffer.split("\n\n")
+      buffer = events.pop()
+      for (const raw of events) {
+        const event = this.parseServerSentEvent(raw)
+        if (event.type === "token") {
+          showMessage().textContent += event.data.text
+          this.scrollToBottom()
+        } else if (event.type === "done") {
+          showMessage().textContent = event.data.response
+          this.scrollToBottom()
+        } else if (event.type === "error") {
+          throw new Error(event.data.error)
+        }
+      }
+    }
+  },
+
+  parseServerSentEvent(raw) {
+    let type = "message"
+    let data = ""
+    for (const line of raw.split("\n")) {
+      if (line.startsWith("event: ")) type = line.slice(7)
+      else if (line.startsWith("data: ")) data += line.slice(6)
+    }
+    return { type, data: data ? JSON.parse(data) : null }
+  },
+
   addUserMessage(text) {
     const msg = document.createElement("div")
     msg.textContent = text
@@ -356,6 +412,7 @@ const ChatbotWidget = {
     Object.assign(msg.style, style)
     this.elements.messages.appendChild(msg)
     this.scrollToBottom()
+    return msg
   },
 
   addErrorMessage(text) {